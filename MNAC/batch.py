@@ -0,0 +1,203 @@
+'''NumPy lockstep simulator for random games of Meta Noughts and Crosses.
+
+Advances many games at once, one sub-move (start grid, cell or send)
+per step, with each game's cells held in an (N, 9, 9) array. Moves are
+picked uniformly from the legal options, exactly as `MNAC.stressTest`
+does, so the outcome statistics match `mnac._test`.
+
+    python batch.py 10000000 --no-middle
+'''
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+import mnac
+
+TAGS = {0: 'errors', 1: 'noughts', 2: 'crosses', 3: 'draws'}
+
+BEGIN, INNER, OUTER = 0, 1, 2
+
+# start grid, then at most a placement and a send for each cell
+MAX_MOVES = 1 + 81 * 2
+
+LINES = np.array(mnac.LINES)
+
+STATUS = np.frombuffer(mnac.STATUS, dtype=np.uint8).astype(np.int8)
+TRITS = np.array(mnac.TRITS, dtype=np.int32)
+
+
+def metaStatus(status):
+    '''Vectorised mnac.metaStatus over rows of an (N, 9) status array.'''
+    lines = status[:, LINES]  # (N, 8, 3)
+    full = (lines[:, :, 0] != 0) & (lines[:, :, 0] == lines[:, :, 1]) & \
+        (lines[:, :, 1] == lines[:, :, 2])
+    first = full.argmax(axis=1)
+    rows = np.arange(len(status))
+    winner = np.where(full.any(axis=1), lines[rows, first, 0], 0)
+    # a line is open to a player while it holds no other status
+    openLines = ((lines == 0) | (lines == 1)).all(axis=2) | \
+        ((lines == 0) | (lines == 2)).all(axis=2)
+    dead = ~openLines.any(axis=1) | (status != 0).all(axis=1)
+    return np.where((winner == 0) & dead, 3, winner)
+
+
+def choose(rng, options):
+    '''Uniformly random True column of each row of a boolean array,
+    or -1 where a row has no options.'''
+    keys = rng.random(options.shape)
+    keys[~options] = -1
+    choice = keys.argmax(axis=1)
+    return np.where(options.any(axis=1), choice, -1)
+
+
+class Batch:
+    '''N random games played in lockstep.'''
+
+    def __init__(self, n, middleStart=True, rng=None):
+        self.n = n
+        self.middleStart = middleStart
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        self.cells = np.zeros((n, 9, 9), dtype=np.int8)
+        self.codes = np.zeros((n, 9), dtype=np.int32)
+        self.status = np.zeros((n, 9), dtype=np.int8)
+        self.grid = np.zeros(n, dtype=np.int8)
+        self.state = np.full(n, BEGIN, dtype=np.int8)
+        self.player = np.ones(n, dtype=np.int8)
+        self.winner = np.zeros(n, dtype=np.int8)
+        self.moves = np.zeros(n, dtype=np.int16)
+        self.firstGrid = np.zeros(n, dtype=np.int8)
+        self.done = np.zeros(n, dtype=bool)
+
+    def step(self):
+        '''Play one sub-move in every unfinished game.
+        Returns the number of games still running.'''
+        live = ~self.done
+        begin, inner, outer = (
+            np.nonzero(live & (self.state == state))[0]
+            for state in (BEGIN, INNER, OUTER))
+        self._begin(begin)
+        self._inner(inner)
+        self._outer(outer)
+        return self.n - int(self.done.sum())
+
+    def run(self):
+        while self.step():
+            pass
+        return self
+
+    def _begin(self, rows):
+        if not len(rows):
+            return
+        options = np.ones((len(rows), 9), dtype=bool)
+        if not self.middleStart:
+            options[:, 4] = False
+        grid = choose(self.rng, options)
+        self.grid[rows] = grid
+        self.firstGrid[rows] = grid
+        self.state[rows] = INNER
+        self.moves[rows] += 1
+
+    def _outer(self, rows):
+        if not len(rows):
+            return
+        options = self.status[rows] == 0
+        options[np.arange(len(rows)), self.grid[rows]] = False
+        grid = choose(self.rng, options)
+
+        stuck = grid < 0
+        self.done[rows[stuck]] = True
+        rows, grid = rows[~stuck], grid[~stuck]
+
+        self.grid[rows] = grid
+        self.player[rows] = 3 - self.player[rows]
+        self.state[rows] = INNER
+        self.moves[rows] += 1
+
+    def _inner(self, rows):
+        if not len(rows):
+            return
+        grid = self.grid[rows].astype(np.intp)
+        player = self.player[rows]
+        cell = choose(self.rng, self.cells[rows, grid] == 0)
+
+        self.cells[rows, grid, cell] = player
+        self.codes[rows, grid] += player * TRITS[cell]
+        self.moves[rows] += 1
+
+        # only the grid just played in can change status
+        status = STATUS[self.codes[rows, grid]]
+        flipped = status != self.status[rows, grid]
+        self.status[rows, grid] = status
+        if flipped.any():
+            changed = rows[flipped]
+            winner = metaStatus(self.status[changed])
+            # if only one grid remains and the play in the last
+            # grid remaining did not win, it is a draw
+            lastGrid = (self.status[changed] != 0).sum(axis=1) == 8
+            self.winner[changed] = np.where(
+                (winner == 0) & lastGrid, 3, winner)
+            self.done[changed] = self.winner[changed] != 0
+
+        teleport = (cell == grid) | (self.status[rows, cell] != 0)
+        # a teleport with only one grid to send to sends there at once
+        sends = self.status[rows] == 0
+        sends[np.arange(len(rows)), grid] = False
+        forced = teleport & (sends.sum(axis=1) == 1) & (self.winner[rows] == 0)
+        cell = np.where(forced, sends.argmax(axis=1), cell)
+        teleport &= ~forced
+
+        self.state[rows[teleport]] = OUTER
+        moved = ~teleport
+        self.grid[rows[moved]] = cell[moved]
+        self.player[rows[moved]] = 3 - player[moved]
+
+
+def simulate(n, middleStart=True, seed=None, batchSize=100000):
+    '''Play n random games. Returns a tuple of the count of each
+    winner (indexed like TAGS) and a histogram of game lengths.'''
+    rng = np.random.default_rng(seed)
+    counts = np.zeros(4, dtype=np.int64)
+    lengths = np.zeros(MAX_MOVES + 1, dtype=np.int64)
+    while n > 0:
+        batch = Batch(min(n, batchSize), middleStart, rng).run()
+        counts += np.bincount(batch.winner, minlength=4)
+        lengths += np.bincount(batch.moves, minlength=len(lengths))
+        n -= batch.n
+    return counts, lengths
+
+
+def _test(n=1000000, middleStart=True, seed=None):
+    '''Print outcome statistics in the same format as mnac._test.'''
+    start = time.perf_counter()
+    counts, lengths = simulate(n, middleStart=middleStart, seed=seed)
+    time_taken = time.perf_counter() - start
+
+    fmt = ('{:<%s} ' % math.ceil(math.log10(n))).format
+
+    print(
+        fmt(n) + 'games in {:.1f}s ({:.6f}s per game)'.format(time_taken, time_taken / n))
+    for i, tag in TAGS.items():
+        tag_n = int(counts[i])
+        proportion = 10 + math.ceil(10 * math.log10((tag_n or 1) / (n / 3)))
+        print(fmt(tag_n) + '{:<7} {}'.format(tag, '*' * proportion))
+    mean = (lengths * np.arange(len(lengths))).sum() / n
+    print('mean game length {:.2f} moves'.format(mean))
+
+    return counts, lengths
+
+
+parser = argparse.ArgumentParser(
+    description='Simulate random games of Meta Noughts and Crosses.')
+parser.add_argument('n', type=int, nargs='?', default=1000000,
+                    help='Number of games to play.')
+parser.add_argument('--no-middle', dest='middleStart', action='store_false',
+                    help='Use the house rule forbidding a middle start.')
+parser.add_argument('--seed', type=int, default=None)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    _test(args.n, middleStart=args.middleStart, seed=args.seed)
@@ -0,0 +1,345 @@
+'''Benchmarks for the MNAC core, renderers and frontends.
+
+Every benchmark runs against fixed, seeded positions (opening, midgame
+and endgame) and reports the best time per call over several repeats.
+Results can be saved as JSON and compared against a saved baseline;
+any benchmark slower than the baseline by more than the tolerance,
+or in the baseline but skipped or gone from this run, makes it fail.
+
+    python bench.py --save baseline.json
+    python bench.py --baseline baseline.json --tolerance 0.2
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+
+import mnac
+
+# Number of turns played from the start for each position
+POSITIONS = {'opening': 3, 'midgame': 15, 'endgame': 30}
+
+BENCHMARKS = []
+
+
+def benchmark(name, positions=tuple(POSITIONS)):
+    '''Register a benchmark. The decorated function takes a Position
+    and returns the callable to time, or a tuple of the callable and
+    the number of operations it does per call.'''
+    def register(function):
+        BENCHMARKS.append((name, positions, function))
+        return function
+    return register
+
+
+class Position:
+    '''A seeded game position, and the play() steps that reach it.'''
+
+    def __init__(self, name, turns, seed=2018):
+        rand = random.Random('{}/{}'.format(seed, name))
+        game = mnac.MNAC()
+        steps = []
+        for i in range(turns):
+            moves = game.legalMoves()
+            if not moves:
+                break
+            move = rand.choice(moves)
+            steps += game.steps(move)
+            game.make(move)
+        self.name = name
+        self.steps = steps
+
+    def game(self, cls=mnac.MNAC, *args):
+        game = cls(*args)
+        for i in self.steps:
+            game.play(i)
+        return game
+
+
+# %% core
+
+@benchmark('takenStatus')
+def benchTakenStatus(pos):
+    grids = pos.game().grids
+    return lambda: [mnac.takenStatus(g) for g in grids], 9
+
+
+@benchmark('MNAC.play', positions=('endgame', ))
+def benchPlay(pos):
+    steps = pos.steps
+
+    def replay():
+        game = mnac.MNAC()
+        for i in steps:
+            game.play(i)
+    return replay, len(steps)
+
+
+@benchmark('MNAC._play', positions=('endgame', ))
+def benchPrivatePlay(pos):
+    steps = [i - 1 for i in pos.steps]
+
+    def replay():
+        game = mnac.MNAC()
+        for i in steps:
+            game._play(i)
+    return replay, len(steps)
+
+
+@benchmark('MNAC.check')
+def benchCheck(pos):
+    return pos.game().check
+
+
+@benchmark('MNAC.playableOptions')
+def benchPlayableOptions(pos):
+    return pos.game().playableOptions
+
+
+@benchmark('MNAC.legalMoves')
+def benchLegalMoves(pos):
+    return pos.game().legalMoves
+
+
+@benchmark('MNAC.make+unmake')
+def benchMakeUnmake(pos):
+    game = pos.game()
+    move = game.legalMoves()[0]
+
+    def makeUnmake():
+        game.make(move)
+        game.unmake(move)
+    return makeUnmake
+
+
+@benchmark('MNAC.stressTest', positions=('opening', ))
+def benchStressTest(pos):
+    # reseed every call, so each repeat times the same game
+    def stressTest():
+        random.seed(0)
+        pos.game().stressTest()
+    return stressTest
+
+
+@benchmark('BitMNAC.stressTest', positions=('opening', ))
+def benchBitStressTest(pos):
+    import bitboard
+
+    def stressTest():
+        random.seed(0)
+        pos.game(bitboard.BitMNAC).stressTest()
+    return stressTest
+
+
+@benchmark('MCTS.rollout', positions=('opening', ))
+def benchRollout(pos):
+    import bitboard
+    import mcts
+    board = pos.game(bitboard.BitMNAC)
+    player = mcts.MCTS(seed=0)
+
+    def search():
+        player.reset()
+        player.search(board, 3600, maxRollouts=200)
+    return search, 200
+
+
+# root parallel scaling: seconds per rollout on 1 and N workers
+for workers in sorted({1, max(2, os.cpu_count() or 1)}):
+    @benchmark('MCTS.rollout@{}workers'.format(workers), positions=('opening', ))
+    def benchPoolRollout(pos, workers=workers):
+        import bitboard
+        import mcts
+        board = pos.game(bitboard.BitMNAC)
+        player = mcts.MCTS(workers=workers, seed=0)
+        rollouts = 200 * workers
+
+        def search():
+            player.reset()
+            player.search(board, 3600, maxRollouts=rollouts)
+        return search, rollouts
+
+
+@benchmark('MNAC.__hash__')
+def benchHash(pos):
+    game = pos.game()
+    return lambda: hash(game)
+
+
+@benchmark('getIndex', positions=('opening', ))
+def benchGetIndex(pos):
+    inputs = ('7', 'nw', 'bottom right', 'centre', 'x', '10')
+    return lambda: [mnac.getIndex(i) for i in inputs], len(inputs)
+
+
+# %% renderers and frontends
+
+for size in (225, 450, 900):
+    @benchmark('ImageRender.draw@{}'.format(size))
+    def benchImageRender(pos, size=size):
+        import render
+        game = pos.game()
+        return lambda: render.ImageRender(game, size=size).draw()
+
+
+@benchmark('IncrementalImageRender.draw@450', positions=('endgame', ))
+def benchIncrementalRender(pos):
+    import render
+
+    def replay():
+        game = mnac.MNAC()
+        r = render.IncrementalImageRender(game, size=450)
+        for i in pos.steps:
+            game.play(i)
+            r.draw()
+    return replay, len(pos.steps)
+
+
+@benchmark('AsciiMNAC.__repr__')
+def benchAsciiRepr(pos):
+    import terminal
+    args = terminal.parser.parse_args([])
+    game = pos.game(terminal.AsciiMNAC, args)
+    return lambda: repr(game)
+
+
+class MockCanvas:
+    '''Stands in for tkinter.Canvas: every method is a no-op that
+    returns a fresh item id.'''
+
+    def __init__(self):
+        self.items = 0
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self.items += 1
+            return self.items
+        return method
+
+
+class MockApp:
+    '''Stands in for tk.UIMNAC with an 800x600 window.'''
+
+    def __init__(self, game):
+        import numpy as np
+        self.np = np
+        self.canvas = MockCanvas()
+        self.game = game
+        self.error = ''
+        self.showHelp = False
+        self.computerPlayer = None
+        self.opponent = None
+
+    def coordinate(self):
+        w, h = 800, 600
+        header_height = h / 18
+        h -= header_height
+        s = min(w, h)
+        tl = self.np.array((0, header_height), dtype=float)
+        return w, h, s, tl, header_height
+
+
+@benchmark('CanvasRender.draw')
+def benchCanvasRender(pos):
+    import tk
+    app = MockApp(pos.game())
+    return tk.CanvasRender(app).draw
+
+
+# %% runner
+
+def measure(function, per=1, repeat=5, minTime=0.2):
+    '''Best seconds per operation over several repeats.'''
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    number = max(1, int(number * minTime / 0.2))
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number / per
+
+
+def run(match='', repeat=5, minTime=0.2, log=sys.stderr):
+    positions = {name: Position(name, turns)
+                 for name, turns in POSITIONS.items()}
+    results = {}
+    for name, names, function in BENCHMARKS:
+        for posName in names:
+            key = '{}/{}'.format(name, posName)
+            if match not in key:
+                continue
+            try:
+                timed = function(positions[posName])
+                timed, per = timed if isinstance(timed, tuple) else (timed, 1)
+                timed()  # warm up, and check it can run here at all
+            except (ImportError, OSError) as e:
+                print('{:<40} skipped ({})'.format(key, e), file=log)
+                continue
+            seconds = measure(timed, per, repeat, minTime)
+            results[key] = seconds
+            print('{:<40} {:>12.3f} us'.format(key, seconds * 1e6), file=log)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance, match=''):
+    '''Return the list of (name, baseline, current) regressions.
+
+    Baseline benchmarks (whose name contains match) that did not run,
+    such as ones now skipped, are regressions with a current of None.'''
+    regressions = []
+    old = baseline['results']
+    new = current['results']
+    for name in sorted(old):
+        if match not in name:
+            continue
+        if name not in new:
+            regressions.append((name, old[name], None))
+        elif new[name] > old[name] * (1 + tolerance):
+            regressions.append((name, old[name], new[name]))
+    return regressions
+
+
+parser = argparse.ArgumentParser(
+    description='Benchmark the MNAC core, renderers and frontends.')
+parser.add_argument('-k', dest='match', default='',
+                    help='Only run benchmarks whose name contains this.')
+parser.add_argument('--save', metavar='PATH',
+                    help='Write the results as JSON to PATH.')
+parser.add_argument('--baseline', metavar='PATH',
+                    help='Fail if slower than the JSON results in PATH.')
+parser.add_argument('--tolerance', type=float, default=0.2,
+                    help='Allowed slowdown over the baseline (0.2 = 20%%).')
+parser.add_argument('--repeat', type=int, default=5)
+parser.add_argument('--min-time', dest='minTime', type=float, default=0.2,
+                    help='Rough seconds per repeat of each benchmark.')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    current = run(args.match, args.repeat, args.minTime)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    else:
+        json.dump(current, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance, args.match)
+        for name, old, new in regressions:
+            if new is None:
+                print('MISSING    {:<40} {:>10.3f} us -> did not run'.format(
+                    name, old * 1e6), file=sys.stderr)
+                continue
+            print('REGRESSION {:<40} {:>10.3f} us -> {:>10.3f} us ({:+.0%})'.format(
+                name, old * 1e6, new * 1e6, new / old - 1), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,383 @@
+'''Bitboard-backed Meta Noughts and Crosses engine.
+
+Each player's cells are one 81-bit integer (9 bits per grid, grid-major),
+and each player's won grids are one 9-bit integer. Win detection is a
+lookup into a 512-entry table built from the line masks, so no lists
+are walked or built per move.
+
+`BitMNAC` keeps the `play()` / `playableOptions()` / `MoveError`
+behaviour of `mnac.MNAC`, and exposes `grids` and `gridStatus` as
+read-only views so the renderers and frontends work unchanged.
+'''
+
+import random
+
+import mnac
+from mnac import Move, MoveError, ZOBRIST_CELLS
+
+# mnac.LINES as cell bitmasks
+LINES = tuple((1 << a) | (1 << b) | (1 << c) for a, b, c in mnac.LINES)
+
+FULL = 0x1ff
+
+# WON[mask] is True if the 9-bit mask contains a complete line
+WON = tuple(any(m & line == line for line in LINES) for m in range(512))
+
+# OPEN[mask] is True if some line has no grid in the 9-bit mask
+OPEN = tuple(any(not m & line for line in LINES) for m in range(512))
+
+# BITS[mask] lists the set bit indices of a 9-bit mask, in order
+BITS = tuple(tuple(i for i in range(9) if m >> i & 1) for m in range(512))
+
+# TRITS_OF[mask] is the base-3 grid code with a 1 at each set bit
+TRITS_OF = tuple(sum(mnac.TRITS[i] for i in BITS[m]) for m in range(512))
+
+
+def metaWinner(noughts, crosses, drawn):
+    '''Winner given masks of grids won by each player and drawn,
+    as mnac.metaStatus: a game neither player can win is a draw.'''
+    if WON[noughts]:
+        return 1
+    elif WON[crosses]:
+        return 2
+    elif WON[drawn]:
+        return 3
+    # a line is open to a player while it holds none of the
+    # opponent's grids and no drawn grid
+    if OPEN[crosses | drawn] or OPEN[noughts | drawn]:
+        return 0
+    return 3
+
+
+class BitMNAC(mnac.MNAC):
+    '''Stateful game of Meta Noughts and Crosses, stored as bitmasks.'''
+
+    def __init__(self, startGrid=None, middleStart=True):
+        # boards[p] and metas[p] are indexed by player (1 or 2)
+        self.boards = [0, 0, 0]
+        self.metas = [0, 0, 0]
+        self.drawn = 0
+        self.winner = 0
+        super().__init__(startGrid=startGrid, middleStart=middleStart)
+
+    @classmethod
+    def fromGame(cls, game):
+        '''Copy any MNAC position into a new BitMNAC.'''
+        self = cls(middleStart=game.middleStart)
+        self.grids = game.grids
+        self.check()
+        self.grid = game.grid
+        self.state = game.state
+        self.player = game.player
+        self.moves = game.moves
+        self.lastPlacedGrid = game.lastPlacedGrid
+        self.lastPlacedCell = game.lastPlacedCell
+        self.winner = game.winner
+        self.key = self._computeKey()
+        return self
+
+    # %% views for renderers and frontends
+
+    @property
+    def grids(self):
+        n, x = self.boards[1], self.boards[2]
+        return [[1 if n >> i & 1 else 2 if x >> i & 1 else 0
+                 for i in range(g * 9, g * 9 + 9)] for g in range(9)]
+
+    @grids.setter
+    def grids(self, value):
+        n = x = 0
+        for g, grid in enumerate(value):
+            for c, status in enumerate(grid):
+                if status == 1:
+                    n |= 1 << (g * 9 + c)
+                elif status == 2:
+                    x |= 1 << (g * 9 + c)
+        self.boards = [0, n, x]
+
+    @property
+    def gridStatus(self):
+        n, x, d = self.metas[1], self.metas[2], self.drawn
+        return [1 if n >> g & 1 else 2 if x >> g & 1 else 3 if d >> g & 1
+                else 0 for g in range(9)]
+
+    @gridStatus.setter
+    def gridStatus(self, value):
+        # gridStatus is derived from the boards; see check()
+        pass
+
+    @property
+    def codes(self):
+        n, x = self.boards[1], self.boards[2]
+        return [TRITS_OF[n >> s & FULL] + 2 * TRITS_OF[x >> s & FULL]
+                for s in range(0, 81, 9)]
+
+    @codes.setter
+    def codes(self, value):
+        # likewise derived from the boards
+        pass
+
+    def taken(self):
+        '''9-bit mask of grids that are won or drawn.'''
+        return self.metas[1] | self.metas[2] | self.drawn
+
+    def sendMask(self, grid):
+        '''9-bit mask of grids a teleporter in the given grid can send to.'''
+        return ~self.taken() & FULL & ~(1 << grid)
+
+    def sends(self, grid):
+        return list(BITS[self.sendMask(grid)])
+
+    def free(self, grid):
+        '''9-bit mask of free cells in a grid.'''
+        shift = grid * 9
+        return ~((self.boards[1] | self.boards[2]) >> shift) & FULL
+
+    # %% rules
+
+    def _metaWinner(self):
+        return metaWinner(self.metas[1], self.metas[2], self.drawn)
+
+    def check(self):
+        n, x = self.boards[1], self.boards[2]
+        metas = [0, 0, 0]
+        drawn = 0
+        for g in range(9):
+            shift = g * 9
+            gn, gx = n >> shift & FULL, x >> shift & FULL
+            if WON[gn]:
+                metas[1] |= 1 << g
+            elif WON[gx]:
+                metas[2] |= 1 << g
+            elif gn | gx == FULL:
+                drawn |= 1 << g
+        self.metas = metas
+        self.drawn = drawn
+        self.winner = self._metaWinner()
+
+    def playableOptions(self):
+        '''Returns list of 1-9 that are playable.'''
+        if self.state == 'begin':
+            possible = list(range(1, 10))
+            if not self.middleStart:
+                possible.remove(5)
+            return possible
+        elif self.state == 'inner':
+            return [i + 1 for i in BITS[self.free(self.grid)]]
+        else:
+            return [i + 1 for i in BITS[~self.taken() & FULL]]
+
+    def _play(self, index):
+        frame = self._frameKey()
+        state = self.state
+        if state == 'inner':
+            g = self.grid
+            shift = g * 9
+            bit = 1 << (shift + index)
+            boards = self.boards
+            if (boards[1] | boards[2]) & bit:
+                raise MoveError(11)
+            p = self.player
+            board = boards[p] | bit
+            boards[p] = board
+            self.key ^= ZOBRIST_CELLS[p][shift + index]
+            self.lastPlacedGrid = g
+            self.lastPlacedCell = index
+            if callable(self.onPlace):
+                self.onPlace(g, index)
+
+            # only the grid just played in can change status
+            gridBit = 1 << g
+            if WON[board >> shift & FULL]:
+                self.metas[p] |= gridBit
+            elif (boards[1] | boards[2]) >> shift & FULL == FULL:
+                self.drawn |= gridBit
+            else:
+                gridBit = 0
+
+            taken = self.metas[1] | self.metas[2] | self.drawn
+            if gridBit:
+                self.winner = self._metaWinner()
+                if self.winner:
+                    return
+                # if only one grid remains and the play in the last
+                # grid remaining did not win, it is a draw
+                if bin(taken).count('1') == 8:
+                    self.winner = 3
+
+            if index == g or taken >> index & 1:
+                sends = ~taken & FULL & ~(1 << g)
+                if sends & (sends - 1) or self.winner:
+                    self.state = 'outer'
+                else:
+                    # only one grid to send to, so send there at once
+                    self.grid = BITS[sends][0]
+                    self.player = 3 - p
+            else:
+                self.grid = index
+                self.player = 3 - p
+
+        elif state == 'outer':
+            if index == self.grid:
+                raise MoveError(21)
+            elif self.taken() >> index & 1:
+                raise MoveError(22)
+            self.grid = index
+            self.player = 3 - self.player
+            self.state = 'inner'
+
+        else:
+            if index == 4 and not self.middleStart:
+                raise MoveError(1)  # House rules
+            self.grid = index
+            self.state = 'inner'
+
+        self.key ^= frame ^ self._frameKey()
+
+    def stressTest(self, move_limit=None, rand=random.random):
+        '''Play uniformly random legal moves without raising MoveError.'''
+        moves = self.moves
+        while self.moves - moves != move_limit and not self.winner:
+            if self.state == 'begin':
+                options = FULL if self.middleStart else FULL & ~(1 << 4)
+            elif self.state == 'inner':
+                options = self.free(self.grid)
+            else:
+                options = self.sendMask(self.grid)
+            choices = BITS[options]
+            if not choices:
+                return
+            self._play(choices[int(rand() * len(choices))])
+            self.moves += 1
+
+    def randomPlayout(self, rand=random.random):
+        '''Winner of a uniformly random playout from this position.
+
+        The game itself is untouched; the playout runs entirely on
+        local integers, so it allocates nothing per move.'''
+        if self.winner:
+            return self.winner
+        n, x = self.boards[1], self.boards[2]
+        mn, mx, md = self.metas[1], self.metas[2], self.drawn
+        grid, player, state = self.grid, self.player, self.state
+
+        if state == 'begin':
+            choices = BITS[FULL if self.middleStart else FULL & ~(1 << 4)]
+            grid = choices[int(rand() * len(choices))]
+        elif state == 'outer':
+            choices = BITS[~(mn | mx | md) & FULL & ~(1 << grid)]
+            grid = choices[int(rand() * len(choices))]
+            player = 3 - player
+
+        while True:
+            shift = grid * 9
+            choices = BITS[~((n | x) >> shift) & FULL]
+            cell = choices[int(rand() * len(choices))]
+            gridBit = 1 << grid
+            if player == 1:
+                n |= 1 << (shift + cell)
+                if WON[n >> shift & FULL]:
+                    mn |= gridBit
+                else:
+                    gridBit = 0
+            else:
+                x |= 1 << (shift + cell)
+                if WON[x >> shift & FULL]:
+                    mx |= gridBit
+                else:
+                    gridBit = 0
+            if not gridBit and (n | x) >> shift & FULL == FULL:
+                md |= 1 << grid
+                gridBit = 1
+
+            taken = mn | mx | md
+            if gridBit:
+                winner = metaWinner(mn, mx, md)
+                if winner:
+                    return winner
+                if bin(taken).count('1') == 8:
+                    return 3
+
+            if cell == grid or taken >> cell & 1:
+                choices = BITS[~taken & FULL & ~(1 << grid)]
+                grid = choices[int(rand() * len(choices))]
+            else:
+                grid = cell
+            player = 3 - player
+
+    # %% search interface
+
+    def _endsGame(self, grid, won):
+        '''Would the given grid being won (or else drawn) end the game?'''
+        n, x, d = self.metas[1], self.metas[2], self.drawn
+        bit = 1 << grid
+        if not won:
+            d |= bit
+        elif self.player == 1:
+            n |= bit
+        else:
+            x |= bit
+        return bool(metaWinner(n, x, d)) or bin(n | x | d).count('1') == 8
+
+    def legalMoves(self):
+        '''List every complete turn the current player can make.'''
+        if self.winner:
+            return []
+        taken = self.taken()
+
+        if self.state == 'outer':
+            return [Move(self.grid, None, t)
+                    for t in BITS[self.sendMask(self.grid)]]
+        elif self.state == 'begin':
+            starts = [g for g in range(9) if self.middleStart or g != 4]
+        else:
+            starts = [self.grid]
+
+        moves = []
+        for g in starts:
+            shift = g * 9
+            own = self.boards[self.player] >> shift & FULL
+            used = (self.boards[1] | self.boards[2]) >> shift & FULL
+            sends = BITS[~taken & FULL & ~(1 << g)]
+            for c in BITS[~used & FULL]:
+                bit = 1 << c
+                won = WON[own | bit]
+                if (won or used | bit == FULL) and self._endsGame(g, won):
+                    moves.append(Move(g, c, None))
+                elif c == g or taken & bit:
+                    moves.extend(Move(g, c, t) for t in sends)
+                else:
+                    moves.append(Move(g, c, None))
+        return moves
+
+    def make(self, move):
+        '''Play a complete turn from legalMoves(), without validation.
+        It can be taken back with unmake().'''
+        self._history.append((
+            self.grid, self.state, self.player, self.winner, self.moves,
+            self.lastPlacedGrid, self.lastPlacedCell, self.key,
+            self.boards[1], self.boards[2],
+            self.metas[1], self.metas[2], self.drawn))
+        grid, cell, send = move
+        if self.state == 'begin':
+            self._play(grid)
+            self.moves += 1
+        if cell is not None:
+            self._play(cell)
+            self.moves += 1
+            if self.state != 'outer':
+                # finished, or sent on by the cell's play()
+                return
+        if send is not None and not self.winner:
+            self._play(send)
+            self.moves += 1
+
+    def unmake(self, move):
+        '''Take back the last turn played with make().'''
+        (self.grid, self.state, self.player, self.winner, self.moves,
+         self.lastPlacedGrid, self.lastPlacedCell, self.key,
+         self.boards[1], self.boards[2],
+         self.metas[1], self.metas[2], self.drawn) = self._history.pop()
+
+    def __hash__(self):
+        return self.key
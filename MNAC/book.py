@@ -0,0 +1,335 @@
+'''Opening book for Meta Noughts and Crosses, built from game records.
+
+A book is a file of fixed-size entries sorted by the Zobrist key of a
+position and then by move, each counting the games in which that move
+was played there, and how many of those its player won or drew. It
+is read through mmap with a binary search, so any number of processes
+share one copy in the page cache.
+
+    python book.py build opening.book selfplay.mnac --plies 12
+    python book.py merge opening.book a.book b.book
+
+Books are built by BookBuilder, which keeps counts in memory and
+spills them to sorted shards on disk, merging them at the end. A
+symmetric book keys positions by symmetry.canonicalKey, so the
+symmetric versions of a position share their statistics.
+'''
+
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+
+import mnac
+import record
+import symmetry
+
+MAGIC = record.MAGIC + b'B'
+VERSION = 2
+# magic, version, flags
+HEADER = struct.Struct('<5sBB')
+
+# flags
+SYMMETRIC = 1
+
+# key, move, visits, wins, draws
+ENTRY = struct.Struct('<QHxxIII')
+KEY = struct.Struct('<Q')
+
+NONE = 15
+
+
+def encodeMove(move):
+    '''16 bit code of an mnac.Move, ordering moves like tuples.'''
+    grid, cell, send = move
+    return (grid << 8 | (NONE if cell is None else cell) << 4 |
+            (NONE if send is None else send))
+
+
+def _decodeMove(code):
+    cell, send = code >> 4 & 15, code & 15
+    return mnac.Move(code >> 8, None if cell == NONE else cell,
+                     None if send == NONE else send)
+
+
+_MOVES = [_decodeMove(code) for code in range(9 << 8)]
+
+
+def decodeMove(code):
+    '''mnac.Move from its code.'''
+    return _MOVES[code]
+
+
+# %% reading
+
+def _readHeader(f, path):
+    '''Flags of a book, from the header at the start of a file.'''
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+        raise ValueError('not an MNAC opening book: {}'.format(path))
+    magic, version, flags = HEADER.unpack(header)
+    if version != VERSION:
+        raise ValueError('unknown opening book version {}: {}'.format(
+            version, path))
+    return flags
+
+
+def readFlags(path):
+    with open(path, 'rb') as f:
+        return _readHeader(f, path)
+
+
+class Book:
+    '''Read-only opening book.'''
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.flags = _readHeader(self.file, path)
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+        self.symmetric = bool(self.flags & SYMMETRIC)
+        self.entries = (len(self.map) - HEADER.size) // ENTRY.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.entries
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def _first(self, key):
+        '''Index of the first entry with a key no less than key.'''
+        low, high = 0, self.entries
+        unpack, data, start = KEY.unpack_from, self.map, HEADER.size
+        size = ENTRY.size
+        while low < high:
+            mid = (low + high) // 2
+            if unpack(data, start + mid * size)[0] < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def lookup(self, key):
+        '''List of (move, visits, wins, draws) for a position key.'''
+        start = self._first(key)
+        if start == self.entries or \
+                KEY.unpack_from(self.map, HEADER.size + start * ENTRY.size)[0] != key:
+            return []
+        stop = self._first(key + 1)
+        data = self.map[HEADER.size + start * ENTRY.size:
+                        HEADER.size + stop * ENTRY.size]
+        return [(_MOVES[code], visits, wins, draws)
+                for _, code, visits, wins, draws in ENTRY.iter_unpack(data)]
+
+    def moves(self, game):
+        '''List of (move, visits, wins, draws) for a game's position.'''
+        if not self.symmetric:
+            return self.lookup(game.key)
+        key, t = symmetry.canonicalKey(game)
+        inverse = symmetry.INVERSE[t]
+        return [(symmetry.transformMove(move, inverse), visits, wins, draws)
+                for move, visits, wins, draws in self.lookup(key)]
+
+    def choose(self, game, minVisits=8):
+        '''Book move with the best score for a game, counting draws as
+        half a win, or None if no move has been played minVisits times.'''
+        best, bestScore = None, -1
+        for move, visits, wins, draws in self.moves(game):
+            if visits >= minVisits:
+                score = (wins + draws / 2) / visits
+                if score > bestScore:
+                    best, bestScore = move, score
+        # guard against key collisions with unrelated positions
+        if best is not None and self._plausible(game, best):
+            return best
+        return None
+
+    @staticmethod
+    def _plausible(game, move):
+        grid, cell, send = move
+        if game.state != 'begin' and grid != game.grid:
+            return False
+        if (cell is None) != (game.state == 'outer'):
+            return False
+        if cell is not None and game.grids[grid][cell]:
+            return False
+        return send is None or (send != grid and not game.gridStatus[send])
+
+
+def readEntries(path):
+    '''Iterate over the (key, code, visits, wins, draws) entries of a
+    book file a block at a time.'''
+    with open(path, 'rb') as f:
+        _readHeader(f, path)
+        for block in iter(lambda: f.read(ENTRY.size * 4096), b''):
+            if len(block) % ENTRY.size:
+                raise ValueError('truncated opening book: ' + path)
+            yield from ENTRY.iter_unpack(block)
+
+
+# %% writing
+
+def writeEntries(path, entries, minVisits=1, flags=0):
+    '''Write a book from entries sorted by key and code. Entries with
+    the same key and code are added together. Returns the entry count.
+
+    The book is written beside path and renamed over it when complete,
+    so readers never see part of a book.'''
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    count = 0
+    with open(temp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, flags))
+        pack = ENTRY.pack
+        last = None
+        for key, code, visits, wins, draws in entries:
+            if last and last[0] == key and last[1] == code:
+                last[2] += visits
+                last[3] += wins
+                last[4] += draws
+                continue
+            if last and last[2] >= minVisits:
+                f.write(pack(*last))
+                count += 1
+            last = [key, code, visits, wins, draws]
+        if last and last[2] >= minVisits:
+            f.write(pack(*last))
+            count += 1
+    os.replace(temp, path)
+    return count
+
+
+def merge(paths, out, minVisits=1):
+    '''Merge book files (or shards of one) into a new book at out.'''
+    flags = set(map(readFlags, paths))
+    if len(flags) > 1:
+        raise ValueError('cannot merge symmetric and plain books')
+    return writeEntries(out, heapq.merge(*map(readEntries, paths)),
+                        minVisits, flags.pop() if flags else 0)
+
+
+class BookBuilder:
+    '''Collects move statistics from game records into a book.
+
+    Only the first `plies` turns of each game are counted. Counts are
+    held in memory and written out as a sorted shard whenever there
+    are shardSize of them, so any number of games can be added.'''
+
+    def __init__(self, plies=16, shardSize=1 << 20, directory=None,
+                 symmetric=False):
+        self.plies = plies
+        self.symmetric = symmetric
+        self.shardSize = shardSize
+        self.directory = directory
+        self.counts = {}
+        self.shards = []
+        self.games = 0
+
+    def add(self, game):
+        '''Count the moves of a record.GameRecord. Unfinished games
+        are skipped.'''
+        final = mnac.MNAC(game.startGrid, game.middleStart)
+        turns = []
+        for turn in game.turns(final):
+            if len(turns) < self.plies:
+                turns.append(turn)
+        winner = final.winner
+        if not winner:
+            return
+        self.games += 1
+        if self.symmetric:
+            turns = self._canonical(game, turns)
+        counts = self.counts
+        for key, player, move in turns:
+            entry = counts.get((key, encodeMove(move)))
+            if entry is None:
+                entry = counts[key, encodeMove(move)] = [0, 0, 0]
+            entry[0] += 1
+            if winner == player:
+                entry[1] += 1
+            elif winner == 3:
+                entry[2] += 1
+        if len(counts) >= self.shardSize:
+            self.spill()
+
+    @staticmethod
+    def _canonical(game, turns):
+        board = mnac.MNAC(game.startGrid, game.middleStart)
+        canonical = []
+        for key, player, move in turns:
+            key, t = symmetry.canonicalKey(board)
+            canonical.append((key, player, symmetry.transformMove(move, t)))
+            board.make(move)
+        return canonical
+
+    def addAll(self, games):
+        for game in games:
+            self.add(game)
+        return self
+
+    def spill(self):
+        '''Write the counts so far to a shard, and clear them.'''
+        if not self.counts:
+            return
+        fd, path = tempfile.mkstemp(suffix='.book', dir=self.directory)
+        os.close(fd)
+        writeEntries(path, (key + tuple(entry) for key, entry in
+                            sorted(self.counts.items())),
+                     flags=SYMMETRIC if self.symmetric else 0)
+        self.shards.append(path)
+        self.counts = {}
+
+    def finish(self, path, minVisits=1):
+        '''Write the book to path, dropping moves played fewer than
+        minVisits times. Returns the entry count.'''
+        self.spill()
+        try:
+            return merge(self.shards, path, minVisits)
+        finally:
+            for shard in self.shards:
+                os.remove(shard)
+            self.shards = []
+
+
+parser = argparse.ArgumentParser(
+    description='Build or merge MNAC opening books.')
+commands = parser.add_subparsers(dest='command', required=True)
+build = commands.add_parser('build', help='Build a book from game records.')
+build.add_argument('book')
+build.add_argument('games', nargs='+', help='Game record files.')
+build.add_argument('--plies', type=int, default=16,
+                   help='Turns from the start of each game to count.')
+build.add_argument('--min-visits', dest='minVisits', type=int, default=1)
+build.add_argument('--symmetric', action='store_true',
+                   help='Share statistics between symmetric positions.')
+build.add_argument('--shard-size', dest='shardSize', type=int, default=1 << 20,
+                   help='Positions held in memory before spilling to disk.')
+merger = commands.add_parser('merge', help='Merge books into one.')
+merger.add_argument('book')
+merger.add_argument('books', nargs='+')
+merger.add_argument('--min-visits', dest='minVisits', type=int, default=1)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.command == 'build':
+        builder = BookBuilder(args.plies, args.shardSize,
+                              os.path.dirname(os.path.abspath(args.book)),
+                              args.symmetric)
+        for path in args.games:
+            builder.addAll(record.readGames(path))
+        entries = builder.finish(args.book, args.minVisits)
+        print('{} entries from {} games'.format(entries, builder.games))
+    else:
+        print('{} entries'.format(merge(args.books, args.book, args.minVisits)))
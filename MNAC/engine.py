@@ -0,0 +1,272 @@
+'''Alpha-beta computer opponent for Meta Noughts and Crosses.
+
+Negamax search over complete turns (`MNAC.legalMoves()`), using
+`make()` / `unmake()` and the Zobrist `key` of the game. Searches are
+iteratively deepened under a wall-clock budget, use a fixed-size
+transposition table, and order moves by TT move, killers and history.
+'''
+
+from collections import namedtuple
+import time
+
+import mnac
+
+SearchResult = namedtuple('SearchResult', 'move score nodes depth')
+
+WIN = 100000
+
+# Value of each grid on the meta board: centre, corners, edges
+GRID_WEIGHT = (3, 2, 3, 2, 4, 2, 3, 2, 3)
+
+# Meta line with 0, 1 or 2 grids won and none lost
+META_LINE = (0, 30, 150)
+
+# TT entry bounds
+EXACT, LOWER, UPPER = 0, 1, 2
+
+_gridValues = None
+
+
+def gridValues():
+    '''Score of every possible grid for noughts, indexed like mnac.STATUS.
+
+    Lines still open to one player count for them, twice as much
+    if two of its cells are already taken.'''
+    global _gridValues
+    if _gridValues is None:
+        values = []
+        for code in range(3 ** 9):
+            cells = [code // t % 3 for t in mnac.TRITS]
+            score = 0
+            for line in mnac.LINES:
+                marks = [cells[i] for i in line]
+                if 2 not in marks:
+                    score += (0, 1, 3)[min(marks.count(1), 2)]
+                if 1 not in marks:
+                    score -= (0, 1, 3)[min(marks.count(2), 2)]
+            values.append(score)
+        _gridValues = tuple(values)
+    return _gridValues
+
+
+def evaluate(game, player):
+    '''Static score of an unfinished position from player's view.'''
+    values = gridValues()
+    status = game.gridStatus
+    # a property on BitMNAC, built afresh on every access
+    codes = game.codes
+    score = 0
+    for g in range(9):
+        s = status[g]
+        if s == 0:
+            score += values[codes[g]] * GRID_WEIGHT[g]
+        elif s == 1:
+            score += 20 * GRID_WEIGHT[g]
+        elif s == 2:
+            score -= 20 * GRID_WEIGHT[g]
+    for a, b, c in mnac.LINES:
+        line = (status[a], status[b], status[c])
+        if 3 in line:
+            continue
+        if 2 not in line:
+            score += META_LINE[line.count(1)]
+        elif 1 not in line:
+            score -= META_LINE[line.count(2)]
+    return score if player == 1 else -score
+
+
+class _Timeout(Exception):
+    pass
+
+
+class Engine:
+    '''Iterative-deepening negamax searcher.
+
+    The transposition table holds at most `ttSize` entries in slots
+    indexed by key. A slot is replaced by a deeper search of any
+    position, or by any search from a newer call to search().
+
+    With an opening book (book.Book), positions in it are answered
+    from the book without searching.'''
+
+    def __init__(self, ttSize=1 << 18, book=None):
+        self.ttSize = ttSize
+        self.book = book
+        self.table = [None] * ttSize
+        self.generation = 0
+        self.history = {}
+        self.killers = []
+
+    def clear(self):
+        self.table = [None] * self.ttSize
+        self.history = {}
+
+    def search(self, game, timeLimit=1.0, maxDepth=64, stop=None):
+        '''Find the best turn for the player to move.
+
+        Returns a SearchResult; the move is None if the game is over.
+        Book moves are returned with a depth of 0. Setting stop, a
+        threading.Event, from another thread ends the search early
+        as if its time were up.'''
+        moves = game.legalMoves()
+        if not moves:
+            return SearchResult(None, 0, 0, 0)
+        if self.book is not None:
+            move = self.book.choose(game)
+            if move is not None:
+                return SearchResult(move, 0, 0, 0)
+
+        self.generation = (self.generation + 1) & 0xff
+        self.killers = [[None, None] for i in range(maxDepth + 1)]
+        self.nodes = 0
+        self.deadline = time.perf_counter() + timeLimit
+        self.stop = stop
+        self.line = []
+
+        result = SearchResult(moves[0], 0, 0, 0)
+        for depth in range(1, maxDepth + 1):
+            try:
+                score, move = self._root(game, moves, depth)
+            except _Timeout:
+                for m in reversed(self.line):
+                    game.unmake(m)
+                break
+            result = SearchResult(move, score, self.nodes, depth)
+            if abs(score) >= WIN - 1000:
+                break  # forced result found
+        return result._replace(nodes=self.nodes)
+
+    def tableMove(self, game):
+        '''Best turn found for a position by earlier searches, if it is
+        still in the transposition table.'''
+        entry = self.table[game.key % self.ttSize]
+        return entry[4] if entry and entry[0] == game.key else None
+
+    def _root(self, game, moves, depth):
+        player = game.player
+        moves = self._order(moves, self.tableMove(game), 0)
+
+        alpha, beta = -WIN - 1, WIN + 1
+        best = moves[0]
+        for move in moves:
+            self.line.append(move)
+            game.make(move)
+            score = -self._negamax(game, depth - 1, -beta, -alpha, 1,
+                                   3 - player)
+            game.unmake(move)
+            self.line.pop()
+            if score > alpha:
+                alpha, best = score, move
+        self._store(game.key, depth, alpha, EXACT, best)
+        return alpha, best
+
+    def _negamax(self, game, depth, alpha, beta, ply, player):
+        self.nodes += 1
+        if not self.nodes & 0x3ff and (
+                time.perf_counter() > self.deadline or
+                self.stop is not None and self.stop.is_set()):
+            raise _Timeout
+
+        if game.winner:
+            if game.winner == 3:
+                return 0
+            return WIN - ply if game.winner == player else ply - WIN
+        if depth <= 0:
+            return evaluate(game, player)
+
+        key = game.key
+        slot = key % self.ttSize
+        entry = self.table[slot]
+        ttMove = None
+        if entry and entry[0] == key:
+            ttMove = entry[4]
+            if entry[1] >= depth:
+                score = self._fromTable(entry[2], ply)
+                flag = entry[3]
+                if flag == EXACT:
+                    return score
+                elif flag == LOWER and score >= beta:
+                    return score
+                elif flag == UPPER and score <= alpha:
+                    return score
+
+        original = alpha
+        best = None
+        for move in self._order(game.legalMoves(), ttMove, ply):
+            self.line.append(move)
+            game.make(move)
+            score = -self._negamax(game, depth - 1, -beta, -alpha, ply + 1,
+                                   3 - player)
+            game.unmake(move)
+            self.line.pop()
+            if score > alpha:
+                alpha, best = score, move
+                if alpha >= beta:
+                    self._cutoff(move, depth, ply)
+                    break
+
+        flag = (UPPER if alpha <= original else
+                LOWER if alpha >= beta else EXACT)
+        self._store(key, depth, self._toTable(alpha, ply), flag, best)
+        return alpha
+
+    # %% move ordering
+
+    def _order(self, moves, ttMove, ply):
+        history = self.history
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+
+        def priority(move):
+            if move == ttMove:
+                return 1 << 30
+            elif move in killers:
+                return 1 << 29
+            return history.get(move, 0)
+        return sorted(moves, key=priority, reverse=True)
+
+    def _cutoff(self, move, depth, ply):
+        self.history[move] = self.history.get(move, 0) + depth * depth
+        if ply < len(self.killers):
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+
+    # %% transposition table
+
+    def _store(self, key, depth, score, flag, move):
+        slot = key % self.ttSize
+        entry = self.table[slot]
+        if (entry is None or entry[5] != self.generation
+                or depth >= entry[1]):
+            self.table[slot] = (key, depth, score, flag, move,
+                                self.generation)
+
+    @staticmethod
+    def _toTable(score, ply):
+        # store forced results relative to the node, not the root
+        if score >= WIN - 1000:
+            return score + ply
+        elif score <= 1000 - WIN:
+            return score - ply
+        return score
+
+    @staticmethod
+    def _fromTable(score, ply):
+        if score >= WIN - 1000:
+            return score - ply
+        elif score <= 1000 - WIN:
+            return score + ply
+        return score
+
+
+if __name__ == '__main__':
+    game = mnac.MNAC(middleStart=False)
+    engine = Engine()
+    while not game.winner:
+        result = engine.search(game, timeLimit=0.5)
+        print('{} {:>6} {:>7} nodes, depth {}'.format(
+            game.steps(result.move), result.score, result.nodes,
+            result.depth))
+        game.make(result.move)
+    print(['Noughts wins', 'Crosses wins', "It's a draw"][game.winner - 1])
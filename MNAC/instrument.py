@@ -0,0 +1,213 @@
+'''Opt-in call counts and timings for the game core and renderers.
+
+Nothing is patched. instrumented(cls) makes a subclass whose hot
+methods are timed; classFor(cls) returns that subclass only while
+instrumentation is on, and the class itself otherwise, so code can
+keep classFor() in place at no cost:
+
+    game = instrument.classFor(mnac.MNAC)()
+
+Timings go to METRICS, one per process, and snapshot() returns them as
+a dict. Set MNAC_METRICS to a path (optionally with a {pid} field) to
+turn instrumentation on and dump the snapshot there as JSON every
+MNAC_METRICS_INTERVAL seconds (10 by default):
+
+    MNAC_METRICS=metrics.{pid}.json python server.py
+
+Worker processes forked later start afresh and dump to their own path.
+'''
+
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import threading
+import time
+
+import mnac
+
+# Methods timed by default, by the name of a base class
+METHODS = {
+    'MNAC': ('play', '_play', 'check', '_checkGrid', 'metaStatus', 'onPlace'),
+    'Render': ('draw', 'ellipse', 'text'),
+}
+
+
+class Metrics:
+    '''Call counts, cumulative times and MoveError counts.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = Counter()
+            self.times = Counter()
+            self.errors = Counter()
+            self.since = time.time()
+
+    def add(self, name, elapsed):
+        with self.lock:
+            self.calls[name] += 1
+            self.times[name] += elapsed
+
+    def error(self, code):
+        with self.lock:
+            self.errors[code] += 1
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        '''Counts and times so far, as a dict ready for JSON.'''
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'since': self.since,
+                'time': time.time(),
+                'calls': {name: {
+                    'count': n,
+                    'total': self.times[name],
+                    'mean': self.times[name] / n,
+                } for name, n in sorted(self.calls.items())},
+                'moveErrors': {str(code): n for code, n in sorted(self.errors.items())},
+            }
+
+    def dump(self, path):
+        '''Write the snapshot to path as JSON, replacing it whole.'''
+        path = path.format(pid=os.getpid())
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'w') as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(temp, path)
+
+
+METRICS = Metrics()
+
+_enabled = False
+_dumping = None  # (path, interval) of the periodic dump
+
+
+def enabled():
+    return _enabled
+
+
+def enable(path=None, interval=10):
+    '''Turn instrumentation on, dumping METRICS to path every interval
+    seconds if a path is given.'''
+    global _enabled, _dumping
+    _enabled = True
+    if path and _dumping is None:
+        _dumping = (path, interval)
+        _startDumping()
+
+
+def disable():
+    '''Turn instrumentation off for classes got from classFor() after
+    this; instances already made stay instrumented.'''
+    global _enabled, _dumping
+    _enabled = False
+    _dumping = None
+
+
+def _startDumping():
+    dumping = _dumping
+
+    def run():
+        path, interval = dumping
+        while _dumping is dumping:
+            time.sleep(interval)
+            METRICS.dump(path)
+
+    threading.Thread(target=run, name='metrics', daemon=True).start()
+
+
+def _afterFork():
+    # threads do not survive fork, and the parent's counts are not ours
+    METRICS.lock = threading.Lock()
+    METRICS.reset()
+    if _dumping is not None:
+        _startDumping()
+
+
+os.register_at_fork(after_in_child=_afterFork)
+
+
+def timer(name):
+    '''Context manager timing a block as name, or doing nothing while
+    instrumentation is off.'''
+    return METRICS.timer(name) if _enabled else nullcontext()
+
+
+def _timed(name, method, metrics, countErrors=False):
+    perf_counter = time.perf_counter
+    add = metrics.add
+
+    def timed(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except mnac.MoveError as e:
+            if countErrors:
+                metrics.error(e.code)
+            raise
+        finally:
+            add(name, perf_counter() - start)
+
+    timed.__name__ = method.__name__
+    timed.__doc__ = method.__doc__
+    return timed
+
+
+def _defaultMethods(cls):
+    for base in cls.__mro__:
+        if base.__name__ in METHODS:
+            return METHODS[base.__name__]
+    return ()
+
+
+def _isStatic(cls, name):
+    for base in cls.__mro__:
+        if name in base.__dict__:
+            return isinstance(base.__dict__[name], staticmethod)
+    return False
+
+
+_classes = {}
+
+
+def instrumented(cls, methods=None, metrics=METRICS):
+    '''Subclass of cls timing the given methods (by default those in
+    METHODS) into metrics. MoveErrors raised by play are counted.'''
+    methods = tuple(methods or _defaultMethods(cls))
+    key = (cls, methods, id(metrics))
+    subclass = _classes.get(key)
+    if subclass is not None:
+        return subclass
+
+    namespace = {'__doc__': cls.__doc__, '__module__': cls.__module__}
+    for name in methods:
+        method = getattr(cls, name)
+        label = '{}.{}'.format(cls.__name__, name)
+        if _isStatic(cls, name):
+            namespace[name] = staticmethod(_timed(label, method, metrics))
+        else:
+            namespace[name] = _timed(label, method, metrics, name == 'play')
+    subclass = _classes[key] = type(cls.__name__, (cls, ), namespace)
+    return subclass
+
+
+def classFor(cls, methods=None):
+    '''cls, or its instrumented subclass while instrumentation is on.'''
+    return instrumented(cls, methods) if _enabled else cls
+
+
+if os.environ.get('MNAC_METRICS'):
+    enable(os.environ['MNAC_METRICS'],
+           float(os.environ.get('MNAC_METRICS_INTERVAL', 10)))
@@ -0,0 +1,163 @@
+'''Load test for server.py: many concurrent games of random moves.
+
+Each simulated game opens two connections, one for each seat, and the
+seats take turns sending PLAY until the game ends, then start another.
+Every PLAY is timed from sending it to reading its reply, and the run
+reports moves per second and latency percentiles.
+
+    python server.py &
+    python loadtest.py --games 1000 --duration 30
+
+or start a server just for the run with --spawn.
+'''
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import mnac
+
+
+class Connection:
+    '''Client end of the line protocol, one request at a time.'''
+
+    @classmethod
+    async def open(cls, host, port):
+        self = cls()
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        return self
+
+    async def request(self, line):
+        '''Send a command and return the words of its reply, skipping
+        UPDATE and EXPIRED lines pushed in the meantime.'''
+        self.writer.write(line.encode() + b'\n')
+        while True:
+            reply = await self.reader.readline()
+            if not reply:
+                raise ConnectionError('server closed the connection')
+            words = reply.decode().split()
+            if words[0] not in ('UPDATE', 'EXPIRED'):
+                return words
+
+    def close(self):
+        self.writer.close()
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []
+        self.games = 0
+        self.errors = 0
+
+    def percentile(self, p):
+        ordered = sorted(self.latencies)
+        if not ordered:
+            return 0
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def randomIndex(game, rand):
+    '''play() index of a random legal sub-move.'''
+    options = game.playableOptions()
+    if game.state == 'outer':
+        options = [i for i in options if i != game.grid + 1]
+    return rand.choice(options)
+
+
+async def playGames(host, port, deadline, results, rand):
+    seats = [None]
+    try:
+        seats.append(await Connection.open(host, port))
+        seats.append(await Connection.open(host, port))
+        while time.perf_counter() < deadline:
+            reply = await seats[1].request('NEW')
+            gameId = reply[1]
+            await seats[2].request('JOIN ' + gameId)
+
+            game = mnac.MNAC()
+            while not game.winner and time.perf_counter() < deadline:
+                index = randomIndex(game, rand)
+                line = 'PLAY {} {}'.format(
+                    gameId, mnac.DIRECTIONS[index - 1][0])
+                start = time.perf_counter()
+                reply = await seats[game.player].request(line)
+                results.latencies.append(time.perf_counter() - start)
+                if reply[0] != 'STATE':
+                    results.errors += 1
+                    break
+                game.play(index)
+            else:
+                results.games += 1
+    finally:
+        for seat in seats[1:]:
+            seat.close()
+
+
+async def waitForServer(host, port, timeout=10):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            connection = await Connection.open(host, port)
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+        else:
+            connection.close()
+            return
+
+
+async def run(games, duration, host='127.0.0.1', port=4040, seed=0):
+    '''Play `games` games at once for `duration` seconds.'''
+    results = Results()
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(
+        playGames(host, port, deadline, results, random.Random(seed + i))
+        for i in range(games)))
+    return results, time.perf_counter() - start
+
+
+def report(results, elapsed):
+    moves = len(results.latencies)
+    print('{} moves in {} games over {:.1f}s: {:.0f} moves/s'.format(
+        moves, results.games, elapsed, moves / elapsed))
+    print('latency p50 {:.2f}ms  p99 {:.2f}ms  max {:.2f}ms'.format(
+        *(1000 * results.percentile(p) for p in (50, 99, 100))))
+    if results.errors:
+        print('{} errors'.format(results.errors))
+
+
+parser = argparse.ArgumentParser(
+    description='Load test an MNAC server with random games.')
+parser.add_argument('--host', default='127.0.0.1')
+parser.add_argument('--port', type=int, default=4040)
+parser.add_argument('--games', type=int, default=100,
+                    help='Games in play at once (two connections each).')
+parser.add_argument('--duration', type=float, default=10,
+                    help='Seconds to run for.')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--spawn', action='store_true',
+                    help='Start a server for the run, and stop it after.')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    server = None
+    if args.spawn:
+        server = subprocess.Popen([
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+            '--host', args.host, '--port', str(args.port)])
+    try:
+        if server is not None:
+            asyncio.run(waitForServer(args.host, args.port))
+        report(*asyncio.run(run(args.games, args.duration, args.host,
+                                args.port, args.seed)))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
@@ -0,0 +1,320 @@
+'''Monte Carlo Tree Search (UCT) player for Meta Noughts and Crosses.
+
+The tree is searched on a `bitboard.BitMNAC` copy of the game with
+`make()` / `unmake()`, and rollouts use `BitMNAC.randomPlayout`.
+Rollouts can be spread over a process pool, either by growing a
+separate tree per worker and merging the root statistics ('root'), or by
+sending batches of leaves from one tree to the workers ('leaf').
+'''
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import math
+import os
+import random
+import time
+
+import bitboard
+from engine import SearchResult
+
+
+# Levels of the workers' trees merged and kept in root parallel mode.
+# A turn later the tree is reused from a grandchild, which keeps two.
+TREE_DEPTH = 4
+
+# Each Move is kept once and shared by every node for it
+_moves = {}
+intern = _moves.setdefault
+
+
+class Node:
+    '''Tree node for the position reached by a move.
+
+    `wins` is counted in half wins (draws are 1, wins 2) for the player
+    who made the move into the node, so that it stays a small int.
+    Nodes are kept small: children is None until the first is added,
+    and positions are not stored (see MCTS._reuse).'''
+    __slots__ = ('move', 'parent', 'children', 'untried', 'visits', 'wins',
+                 'player')
+
+    def __init__(self, move, parent, player):
+        self.move = move
+        self.parent = parent
+        self.children = None
+        self.untried = None  # filled on first visit
+        self.visits = 0
+        self.wins = 0
+        self.player = player
+
+    def select(self, exploration):
+        '''Child with the highest UCT score.'''
+        log = math.log(self.visits)
+        return max(self.children, key=lambda c: (
+            c.wins / (2 * c.visits) + exploration * math.sqrt(log / c.visits)))
+
+
+def _score(winner, player):
+    '''Half wins for player in a game won by winner.'''
+    return 2 if winner == player else 1 if winner == 3 else 0
+
+
+def _treeStats(node, depth=TREE_DEPTH):
+    '''Visits and wins of the top levels below a node, as
+    {move: (visits, wins, {move: ...})}.'''
+    if not depth:
+        return {}
+    return {c.move: (c.visits, c.wins, _treeStats(c, depth - 1))
+            for c in node.children or ()}
+
+
+def _mergeStats(merged, stats, prior):
+    '''Add tree statistics, less those of the prior they grew from,
+    into merged, which holds [visits, wins, merged] lists.'''
+    for move, (visits, wins, below) in stats.items():
+        move = intern(move, move)
+        priorVisits, priorWins, priorBelow = prior.get(move, (0, 0, {}))
+        entry = merged.setdefault(move, [0, 0, {}])
+        entry[0] += visits - priorVisits
+        entry[1] += wins - priorWins
+        _mergeStats(entry[2], below, priorBelow)
+
+
+def _rootWorker(game, timeLimit, exploration, seed, root, maxRollouts):
+    '''Grow a private tree from root; return its top statistics.'''
+    player = MCTS(exploration=exploration, seed=seed)
+    player.root, player.board = root, game
+    player.search(game, timeLimit, maxRollouts)
+    return _treeStats(player.root), player.rollouts
+
+
+def _leafWorker(game, player, rollouts, seed):
+    '''Half wins from rollouts of a position, for the given player.'''
+    rand = random.Random(seed).random
+    return sum(_score(game.randomPlayout(rand), player)
+               for i in range(rollouts))
+
+
+class MCTS:
+    '''UCT player. Keeps its tree between calls to search(), so the
+    subtree for the position actually reached is reused.
+
+    With workers set, a process pool is used: parallel='root' runs a
+    tree per worker, each starting from the reused subtree, and merges
+    their top TREE_DEPTH levels into the tree kept; parallel='leaf' evaluates
+    leaves in batches of `leafRollouts` on the workers.'''
+
+    def __init__(self, exploration=1.4, workers=None, parallel='root',
+                 leafRollouts=16, seed=None):
+        if parallel not in ('root', 'leaf'):
+            raise ValueError('parallel must be root or leaf')
+        self.exploration = exploration
+        self.workers = workers
+        self.parallel = parallel
+        self.leafRollouts = leafRollouts
+        self.random = random.Random(seed)
+        self.root = None
+        # the position at the root, as left by the last search
+        self.board = None
+        self.rollouts = 0
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def reset(self):
+        '''Forget the tree.'''
+        self.root = self.board = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers or os.cpu_count())
+        return self._pool
+
+    # %% tree
+
+    def _reuse(self, game):
+        '''Find the node for this position among the root, its children
+        and grandchildren; otherwise start a new tree.
+
+        Nodes do not keep their positions, so the children are played
+        on the last search's root position to compare keys.'''
+        board, self.board = self.board, game
+        node = self._find(board, game.key) if self.root else None
+        if node is None:
+            return Node(None, None, 3 - game.player)
+        node.parent = None
+        node.move = None
+        return node
+
+    def _find(self, board, key):
+        if board is None:
+            return None
+        if board.key == key:
+            return self.root
+        for child in self.root.children or ():
+            found = None
+            board.make(child.move)
+            if board.key == key:
+                found = child
+            else:
+                for grandchild in child.children or ():
+                    board.make(grandchild.move)
+                    if board.key == key:
+                        found = grandchild
+                    board.unmake(grandchild.move)
+                    if found:
+                        break
+            board.unmake(child.move)
+            if found:
+                return found
+        return None
+
+    def _descend(self, game):
+        '''Select and expand one leaf, leaving the game at its position.'''
+        node = self.root
+        path = []
+        while True:
+            if node.untried is None:
+                node.untried = [intern(m, m) for m in game.legalMoves()]
+                self.random.shuffle(node.untried)
+            if node.untried:
+                move = node.untried.pop()
+                player = game.player
+                game.make(move)
+                path.append(move)
+                child = Node(move, node, player)
+                if node.children is None:
+                    node.children = [child]
+                else:
+                    node.children.append(child)
+                return child, path
+            if not node.children:
+                return node, path  # game over
+            node = node.select(self.exploration)
+            game.make(node.move)
+            path.append(node.move)
+
+    @staticmethod
+    def _update(node, wins, visits, winsFor):
+        '''Back up results (in half wins) counted for winsFor's player.'''
+        while node is not None:
+            node.visits += visits
+            node.wins += wins if node.player == winsFor else 2 * visits - wins
+            node = node.parent
+
+    def rootStats(self):
+        return [(c.move, c.visits, c.wins / 2) for c in self.root.children or ()]
+
+    # %% search
+
+    def search(self, game, timeLimit=1.0, maxRollouts=None):
+        '''Find the best turn for the player to move.
+
+        Returns an engine.SearchResult with the win rate as the score,
+        the rollout count as nodes and the principal variation length
+        as depth. With maxRollouts, stops after that many rollouts if
+        its time is not up first.'''
+        self.rollouts = 0
+        board = bitboard.BitMNAC.fromGame(game)
+        if board.winner:
+            return SearchResult(None, 0, 0, 0)
+        self.root = self._reuse(board)
+        deadline = time.perf_counter() + timeLimit
+        limit = math.inf if maxRollouts is None else maxRollouts
+
+        if self.workers and self.parallel == 'root':
+            return self._searchRoot(board, timeLimit, maxRollouts)
+        elif self.workers:
+            self._searchLeaf(board, deadline, limit)
+        else:
+            rand = self.random.random
+            while self.rollouts < limit and (
+                    self.rollouts & 0x3f or time.perf_counter() < deadline):
+                node, path = self._descend(board)
+                winner = board.randomPlayout(rand)
+                self._update(node, _score(winner, node.player), 1,
+                             node.player)
+                for move in reversed(path):
+                    board.unmake(move)
+                self.rollouts += 1
+        return self._result(self.rootStats())
+
+    def _searchRoot(self, board, timeLimit, maxRollouts):
+        root = self.root
+        share = None if maxRollouts is None else -(-maxRollouts // self.workers)
+        futures = [
+            self.pool.submit(_rootWorker, board, timeLimit, self.exploration,
+                             self.random.getrandbits(64), root, share)
+            for i in range(self.workers)]
+
+        # every worker started from root, so count its statistics once
+        prior = _treeStats(root)
+        merged = {}
+        _mergeStats(merged, prior, {})
+        for future in futures:
+            stats, rollouts = future.result()
+            self.rollouts += rollouts
+            _mergeStats(merged, stats, prior)
+
+        self.root = Node(None, None, 3 - board.player)
+        self._grow(board, self.root, merged)
+        self.root.visits = sum(c.visits for c in self.root.children)
+        return self._result(self.rootStats())
+
+    def _grow(self, board, node, merged):
+        '''Add merged statistics below a node, at board's position.'''
+        node.children = []
+        for move, (visits, wins, below) in merged.items():
+            child = Node(move, node, board.player)
+            child.visits, child.wins = visits, wins
+            node.children.append(child)
+            if below:
+                board.make(move)
+                self._grow(board, child, below)
+                board.unmake(move)
+        node.untried = [intern(m, m) for m in board.legalMoves()
+                        if m not in merged]
+        self.random.shuffle(node.untried)
+
+    def _searchLeaf(self, board, deadline, limit):
+        pending = {}
+        started = 0
+        while time.perf_counter() < deadline and started < limit or pending:
+            while len(pending) < self.workers * 2 and started < limit and \
+                    time.perf_counter() < deadline:
+                node, path = self._descend(board)
+                # virtual loss, so other leaves get picked meanwhile
+                self._update(node, 0, self.leafRollouts, node.player)
+                future = self.pool.submit(
+                    _leafWorker, board, node.player, self.leafRollouts,
+                    self.random.getrandbits(64))
+                pending[future] = node
+                started += self.leafRollouts
+                for move in reversed(path):
+                    board.unmake(move)
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = pending.pop(future)
+                # replace the virtual loss with the real result
+                self._update(node, future.result(), 0, node.player)
+                self.rollouts += self.leafRollouts
+
+    def _result(self, stats):
+        if not stats:
+            return SearchResult(None, 0, self.rollouts, 0)
+        move, visits, wins = max(stats, key=lambda s: s[1])
+        depth = 0
+        node = self.root
+        while node is not None and node.children:
+            node = max(node.children, key=lambda c: c.visits)
+            depth += 1
+        return SearchResult(move, wins / max(visits, 1), self.rollouts,
+                            depth)
@@ -1,5 +1,6 @@
 '''Meta Noughts and Crosses core game. Requires Python 3.'''
 
+from collections import namedtuple
 import random
 
 # Helper functions
@@ -22,12 +23,21 @@ class MoveError(Exception):
         return ERRORS.get(self.code, 'Unknown error')
 
 
+class Move(namedtuple('Move', 'grid cell send')):
+    '''A complete turn: the grid played in, the cell taken (None if the
+    turn is only a send), and the grid sent to (None if not a teleport).'''
+    __slots__ = ()
+
+
+LINES = (
+    (0, 1, 2), (3, 4, 5), (6, 7, 8),  # horizontal
+    (0, 3, 6), (1, 4, 7), (2, 5, 8),  # vertical
+    (0, 4, 8), (2, 4, 6)  # diagonal
+)
+
+
 def takenStatus(grid):
-    for match in (
-        (0, 1, 2), (3, 4, 5), (6, 7, 8),  # horizontal
-        (0, 3, 6), (1, 4, 7), (2, 5, 8),  # vertical
-        (0, 4, 8), (2, 4, 6)  # diagonal
-    ):
+    for match in LINES:
         statuses = [grid[i] for i in match]
         s = statuses[0]
         if s and all(i == s for i in statuses):
@@ -38,6 +48,68 @@ def takenStatus(grid):
         return 0
 
 
+def isDead(gridStatus):
+    '''True if neither player can complete a line of grids: every line
+    holds a drawn grid or grids won by both players.'''
+    for line in LINES:
+        held = {gridStatus[i] for i in line}
+        held.discard(0)
+        if not held or held == {1} or held == {2}:
+            return False
+    return True
+
+
+def metaStatus(gridStatus):
+    '''Winner of a game from its grid statuses. A game no one can win
+    is a draw as soon as it is dead, not once every grid is taken.'''
+    status = takenStatus(gridStatus)
+    if not status and isDead(gridStatus):
+        return 3
+    return status
+
+
+# Base-3 place value of each cell in an encoded grid
+TRITS = tuple(3 ** i for i in range(9))
+
+def _statusTable():
+    '''Taken status of every possible grid, indexed by its base-3
+    encoding (sum of cell status * 3 ** cell).'''
+    lines = [(1 << a) | (1 << b) | (1 << c) for a, b, c in LINES]
+    won = [any(m & line == line for line in lines) for m in range(512)]
+
+    # bitmask of each player's cells; bit i is cell i
+    noughts = [0] * 3 ** 9
+    crosses = [0] * 3 ** 9
+    for code in range(1, 3 ** 9):
+        rest, s = divmod(code, 3)
+        noughts[code] = noughts[rest] << 1 | (s == 1)
+        crosses[code] = crosses[rest] << 1 | (s == 2)
+    return bytes(
+        1 if won[n] else 2 if won[x] else 3 if n | x == 511 else 0
+        for n, x in zip(noughts, crosses))
+
+
+STATUS = _statusTable()
+
+
+def encodeGrid(grid):
+    return sum(s * t for s, t in zip(grid, TRITS))
+
+
+def _zobrist():
+    '''Fixed-seed 64-bit keys, so hashes agree between processes.'''
+    rand = random.Random(0x4d4e4143)
+    key = lambda: rand.getrandbits(64)
+    cells = [None, [key() for i in range(81)], [key() for i in range(81)]]
+    grids = {g: key() for g in (None, *range(9))}
+    states = {s: key() for s in ('begin', 'inner', 'outer')}
+    return cells, grids, states, key(), key()
+
+
+ZOBRIST_CELLS, ZOBRIST_GRIDS, ZOBRIST_STATES, ZOBRIST_CROSSES, \
+    ZOBRIST_NO_MIDDLE = _zobrist()
+
+
 numpad = [0, 7, 8, 9, 4, 5, 6, 1, 2, 3].index
 
 
@@ -103,6 +175,9 @@ class MNAC:
     # Grid to play in.
     grid = None
 
+    # Called as self.metaStatus, so subclasses can hook it (see instrument)
+    metaStatus = staticmethod(metaStatus)
+
     def __init__(self, startGrid=None, middleStart=True):
         self.middleStart = middleStart
 
@@ -110,6 +185,8 @@ class MNAC:
         self.lastPlacedCell = None
         self.gridStatus = [0] * 9
         self.grids = [[0] * 9 for i in range(9)]
+        self.codes = [0] * 9  # base-3 encoding of each grid
+        self._history = []  # undo records for make()
         self.player = 1
         self.moves = 0
         self.state = 'inner'
@@ -126,10 +203,40 @@ class MNAC:
             self.grid = None
             self.state = 'begin'
 
+        # Zobrist key of the position, kept up to date by _play and make
+        self.key = self._computeKey()
+
+    def _frameKey(self):
+        '''Zobrist key of the grid, state and player to move.'''
+        key = ZOBRIST_GRIDS[self.grid] ^ ZOBRIST_STATES[self.state]
+        return key ^ ZOBRIST_CROSSES if self.player == 2 else key
+
+    def _computeKey(self):
+        '''Zobrist key of the position, computed from scratch.'''
+        key = self._frameKey()
+        if not self.middleStart:
+            key ^= ZOBRIST_NO_MIDDLE
+        for g, grid in enumerate(self.grids):
+            for c, status in enumerate(grid):
+                if status:
+                    key ^= ZOBRIST_CELLS[status][g * 9 + c]
+        return key
+
     def check(self):
-        self.gridStatus = [takenStatus(g) for g in self.grids]
-        self.winner = takenStatus(self.gridStatus)
-        # TODO: detect automatic win or draw
+        '''Recompute every grid status and the winner from scratch.'''
+        self.codes = [encodeGrid(g) for g in self.grids]
+        self.gridStatus = [STATUS[c] for c in self.codes]
+        self.winner = self.metaStatus(self.gridStatus)
+
+    def _checkGrid(self, grid):
+        '''Update statuses after a cell in one grid is taken.
+
+        Only that grid can change, so the meta grid is only
+        re-checked (for a win or a dead game) when its status flips.'''
+        status = STATUS[self.codes[grid]]
+        if status != self.gridStatus[grid]:
+            self.gridStatus[grid] = status
+            self.winner = self.metaStatus(self.gridStatus)
 
     def play(self, index):
         '''Play with index 1 through 9.'''
@@ -142,6 +249,11 @@ class MNAC:
     def _swapPlayer(self):
         self.player = 2 if self.player == 1 else 1
 
+    def sends(self, grid):
+        '''Grids a teleporter in the given grid can send to.'''
+        gridStatus = self.gridStatus
+        return [t for t in range(9) if t != grid and not gridStatus[t]]
+
     def onPlace(self, grid, cell):
         '''Overwritable, called when a cell is taken.'''
         pass
@@ -159,21 +271,25 @@ class MNAC:
             return [i+1 for i in range(9) if scan[i] == 0]
 
     def _play(self, index):
+        frame = self._frameKey()
         if self.state == 'begin':
             if index == 4 and not self.middleStart:
                 raise MoveError(1)  # House rules
             self.grid = index
             self.state = 'inner'
+            self.key ^= frame ^ self._frameKey()
 
         elif self.state == 'inner':
             if self.grids[self.grid][index] != 0:
                 raise MoveError(11)
             self.grids[self.grid][index] = self.player
+            self.codes[self.grid] += self.player * TRITS[index]
+            self.key ^= ZOBRIST_CELLS[self.player][self.grid * 9 + index]
             self.lastPlacedGrid = self.grid
             self.lastPlacedCell = index
             if callable(self.onPlace):
                 self.onPlace(self.grid, index)
-            self.check()
+            self._checkGrid(self.grid)
             if self.winner:
                 return
 
@@ -185,13 +301,17 @@ class MNAC:
 
             isTeleporterCell = (index == self.grid
                                 or self.gridStatus[index] != 0)
-            if isTeleporterCell:
-                # Todo: auto-send if only one other grid, or draw
-                # if no other grids remain
+            sends = self.sends(self.grid) if isTeleporterCell else ()
+            if len(sends) == 1 and not self.winner:
+                # only one grid to send to, so send there at once
+                self.grid = sends[0]
+                self._swapPlayer()
+            elif isTeleporterCell:
                 self.state = 'outer'
             else:
                 self.grid = index
                 self._swapPlayer()
+            self.key ^= frame ^ self._frameKey()
 
         else:
             # Always gotta go to a different grid that isn't taken
@@ -202,6 +322,7 @@ class MNAC:
             self.grid = index
             self._swapPlayer()
             self.state = 'inner'
+            self.key ^= frame ^ self._frameKey()
 
     def stressTest(self, move_limit=None):
         moves = self.moves
@@ -210,50 +331,133 @@ class MNAC:
             random.shuffle(choices)
             for i in choices:
                 try:
-                    self.play(i)
+                    self.play(i + 1)
                     break
                 except MoveError:
                     continue
             else:
                 return
 
-    def __hash__(self):
-        return hash((
-            self.grid,
-            self.lastPlacedGrid,
-            self.lastPlacedCell,
-            self.player,
-            {'begin': 1, 'inner': 2, 'outer': 3}.get(self.state),
-            tuple(tuple(grid) for grid in self.grids)
-        ))
+    # %% search interface
 
+    def _endsGame(self, grid, status):
+        '''Would the given grid taking this status end the game?'''
+        statuses = self.gridStatus[:]
+        statuses[grid] = status
+        return bool(self.metaStatus(statuses)) or sum(map(bool, statuses)) == 8
 
-def _test(n=1000, **args):
+    def legalMoves(self):
+        '''List every complete turn the current player can make.'''
+        if self.winner:
+            return []
+        gridStatus = self.gridStatus
 
-    TAGS = {0: 'errors', 1: 'noughts', 2: 'crosses', 3: 'draws'}
-    results = {i: [] for i in TAGS.values()}
+        if self.state == 'outer':
+            return [Move(self.grid, None, t) for t in self.sends(self.grid)]
+        elif self.state == 'begin':
+            starts = [g for g in range(9) if self.middleStart or g != 4]
+        else:
+            starts = [self.grid]
+
+        moves = []
+        player = self.player
+        for g in starts:
+            cells = self.grids[g]
+            code = self.codes[g]
+            sends = self.sends(g)
+            for c in range(9):
+                if cells[c]:
+                    continue
+                status = STATUS[code + player * TRITS[c]]
+                if status and self._endsGame(g, status):
+                    moves.append(Move(g, c, None))
+                elif c == g or gridStatus[c]:
+                    moves.extend(Move(g, c, t) for t in sends)
+                else:
+                    moves.append(Move(g, c, None))
+        return moves
+
+    def make(self, move):
+        '''Play a complete turn from legalMoves(), without validation.
+        It can be taken back with unmake().'''
+        grid, cell, send = move
+        self._history.append((
+            self.grid, self.state, self.player, self.winner, self.moves,
+            self.lastPlacedGrid, self.lastPlacedCell, self.gridStatus[grid],
+            self.key))
+        frame = self._frameKey()
 
-    def loop():
-        game = MNAC(**args)
-        game.stressTest()
-        result = TAGS.get(game.winner)
-        results[result].append(game)
+        if self.state == 'begin':
+            self.moves += 1
+            self.grid = grid
 
-    import math
-    import timeit
+        if cell is not None:
+            self.moves += 1
+            self.grids[grid][cell] = self.player
+            self.codes[grid] += self.player * TRITS[cell]
+            self.key ^= ZOBRIST_CELLS[self.player][grid * 9 + cell]
+            self.lastPlacedGrid = grid
+            self.lastPlacedCell = cell
+            self._checkGrid(grid)
+            if self.winner:
+                self.key ^= frame ^ self._frameKey()
+                return
+            if sum(map(bool, self.gridStatus)) == 8:
+                self.winner = 3
+            if not (cell == grid or self.gridStatus[cell]):
+                self.grid = cell
+                self.state = 'inner'
+                self._swapPlayer()
+                self.key ^= frame ^ self._frameKey()
+                return
+            self.state = 'outer'
 
-    time_taken = timeit.timeit(loop, number=n)
+        if send is not None:
+            # a send with only one choice is made by the cell's play()
+            if cell is None or len(self.sends(grid)) > 1:
+                self.moves += 1
+            self.grid = send
+            self.state = 'inner'
+            self._swapPlayer()
+        self.key ^= frame ^ self._frameKey()
+
+    def unmake(self, move):
+        '''Take back the last turn played with make().'''
+        grid, cell, send = move
+        (self.grid, self.state, self.player, self.winner, self.moves,
+         self.lastPlacedGrid, self.lastPlacedCell, status,
+         self.key) = self._history.pop()
+        if cell is not None:
+            self.grids[grid][cell] = 0
+            self.codes[grid] -= self.player * TRITS[cell]
+            self.gridStatus[grid] = status
+
+    def steps(self, move):
+        '''The play() indices (1-9) that make up a turn. A send with
+        only one choice is made automatically, so it has no index.'''
+        grid, cell, send = move
+        steps = [grid + 1] if self.state == 'begin' else []
+        if cell is not None:
+            steps.append(cell + 1)
+            if send is not None and len(self.sends(grid)) == 1:
+                return steps
+        if send is not None:
+            steps.append(send + 1)
+        return steps
 
-    fmt = ('{:<%s} ' % math.ceil(math.log10(n))).format
+    def __hash__(self):
+        return self.key
 
-    print(
-        fmt(n) + 'games in {:.1f}s ({:.4f}s per game)'.format(time_taken, time_taken / n))
-    for i in TAGS.values():
-        tag_n = len(results[i])
-        proportion = 10 + math.ceil(10 * math.log10((tag_n or 1) / (n / 3)))
-        print(fmt(tag_n) + '{:<7} {}'.format(i, '*' * proportion))
 
-    return results
+def _test(n=1000, **args):
+    '''Play n random games and print outcome statistics.
+    See stats.py for the parallel runner.'''
+    import stats
+    import time
+
+    start = time.perf_counter()
+    tally = stats.run(n, processes=1, **args)
+    return stats.report(tally, time.perf_counter() - start, histogram=False)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,304 @@
+'''Compact binary records of games of Meta Noughts and Crosses.
+
+A game record is its start options and the play() indices of every
+sub-move, packed two to a byte:
+
+    options   1 byte: bit 7 middleStart, bits 0-3 start grid (15 = none)
+    length    varint: number of sub-moves
+    moves     (length + 1) // 2 bytes, first move in the low nibble
+
+A snapshot is one position in a fixed 24 byte record: the base-3 code
+of each grid (81 trits), then the grid, state, player and the rest.
+
+Record files start with a 6 byte header naming what they hold.
+Writers append to them, and readers iterate over them a buffer at a
+time, so files of any size can be used without loading them.
+
+    with record.GameWriter('games.mnac') as log:
+        log.write(record.GameRecord(True, None, [5, 1, 3]))
+    for game in record.readGames('games.mnac'):
+        print(game.replay().winner)
+'''
+
+from collections import namedtuple
+from itertools import chain
+import io
+import struct
+
+import mnac
+
+MAGIC = b'MNAC'
+GAMES, SNAPSHOTS = b'G', b'S'
+# games are version 2 since sends with only one choice became automatic
+VERSIONS = {GAMES: 2, SNAPSHOTS: 1}
+HEADER_SIZE = len(MAGIC) + 2
+
+NO_GRID = 15
+STATES = ('begin', 'inner', 'outer')
+
+# grid codes, grid, state and player and middleStart, winner,
+# last placed cell, moves, and a pad byte
+SNAPSHOT = struct.Struct('<9H5Bx')
+
+# play() indices in each nibble of a byte of packed moves
+_PAIRS = [((b & 15) + 1, (b >> 4) + 1) for b in range(256)]
+
+
+class GameRecord(namedtuple('GameRecord', 'middleStart startGrid steps')):
+    '''Start options and play() indices of a game.'''
+    __slots__ = ()
+
+    @classmethod
+    def start(cls, game):
+        '''Empty record for a game yet to be played. Append the index of
+        each play() to its steps, or game.steps(move) before each make().'''
+        if game.moves:
+            raise ValueError('game has already been played')
+        return cls(game.middleStart, game.grid, [])
+
+    def replay(self, cls=mnac.MNAC):
+        '''Play the record out, returning the game.'''
+        game = cls(self.startGrid, self.middleStart)
+        for i in self.steps:
+            game.play(i)
+        return game
+
+    def turns(self, game=None):
+        '''Play the record out as complete turns, yielding the key and
+        player before each turn and its mnac.Move. A final incomplete
+        turn is played but not yielded.
+
+        Pass a new game with the record's options to keep it.'''
+        if game is None:
+            game = mnac.MNAC(self.startGrid, self.middleStart)
+        steps = iter(self.steps)
+        for i in steps:
+            key, player, state = game.key, game.player, game.state
+            grid = game.grid
+            cell = send = None
+            if state == 'begin':
+                grid = i - 1
+                game.play(i)
+                i = next(steps, None)
+                if i is None:
+                    return
+            if state == 'outer':
+                send = i - 1
+                game.play(i)
+            else:
+                cell = i - 1
+                game.play(i)
+                if game.state == 'outer' and not game.winner:
+                    i = next(steps, None)
+                    if i is None:
+                        return
+                    send = i - 1
+                    game.play(i)
+                elif game.grid != cell and not game.winner:
+                    # sent on automatically, to the only grid left
+                    send = game.grid
+            yield key, player, mnac.Move(grid, cell, send)
+
+
+# %% packing
+
+def _putVarint(out, n):
+    while n > 0x7f:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _readVarint(read):
+    n = shift = 0
+    while True:
+        byte = read(1)
+        if not byte:
+            raise ValueError('truncated game record')
+        n |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return n
+        shift += 7
+
+
+def packGame(record):
+    '''Bytes of a GameRecord.'''
+    startGrid = NO_GRID if record.startGrid is None else record.startGrid
+    if startGrid not in range(9) and startGrid != NO_GRID:
+        raise ValueError('start grid must be 0-8 or None')
+    steps = record.steps
+    if any(not 1 <= i <= 9 for i in steps):
+        raise ValueError('moves must be play() indices 1-9')
+
+    out = bytearray(((0x80 if record.middleStart else 0) | startGrid, ))
+    _putVarint(out, len(steps))
+    out += bytes(steps[i] - 1 | steps[i + 1] - 1 << 4
+                 for i in range(0, len(steps) - 1, 2))
+    if len(steps) % 2:
+        out.append(steps[-1] - 1)
+    return bytes(out)
+
+
+def _readGame(read):
+    '''Next GameRecord from a read function, or None at the end.'''
+    options = read(1)
+    if not options:
+        return None
+    length = _readVarint(read)
+    data = read((length + 1) // 2)
+    if len(data) < (length + 1) // 2:
+        raise ValueError('truncated game record')
+
+    startGrid = options[0] & 15
+    steps = list(chain.from_iterable(map(_PAIRS.__getitem__, data)))
+    del steps[length:]
+    return GameRecord(bool(options[0] & 0x80),
+                      None if startGrid == NO_GRID else startGrid, steps)
+
+
+def unpackGame(data):
+    '''GameRecord from the bytes of one game.'''
+    record = _readGame(io.BytesIO(data).read)
+    if record is None:
+        raise ValueError('empty game record')
+    return record
+
+
+def packSnapshot(game):
+    '''Fixed-size bytes of a game's position.'''
+    last = (255 if game.lastPlacedGrid is None
+            else game.lastPlacedGrid * 9 + game.lastPlacedCell)
+    flags = (STATES.index(game.state) | (game.player == 2) << 2 |
+             bool(game.middleStart) << 3)
+    return SNAPSHOT.pack(
+        *(mnac.encodeGrid(g) for g in game.grids),
+        255 if game.grid is None else game.grid, flags,
+        game.winner, last, game.moves)
+
+
+def _snapshot(fields):
+    *codes, grid, flags, winner, last, moves = fields
+    game = mnac.MNAC(middleStart=bool(flags & 8))
+    game.codes = codes
+    game.grids = [[code // t % 3 for t in mnac.TRITS] for code in codes]
+    game.gridStatus = [mnac.STATUS[code] for code in codes]
+    game.grid = None if grid == 255 else grid
+    game.state = STATES[flags & 3]
+    game.player = 2 if flags & 4 else 1
+    # not always takenStatus: a last grid not won is a draw
+    game.winner = winner
+    if last != 255:
+        game.lastPlacedGrid, game.lastPlacedCell = divmod(last, 9)
+    game.moves = moves
+    game.key = game._computeKey()
+    return game
+
+
+def unpackSnapshot(data):
+    '''MNAC at the position in a snapshot.'''
+    return _snapshot(SNAPSHOT.unpack(data))
+
+
+# %% files
+
+def _header(kind):
+    return MAGIC + kind + bytes((VERSIONS[kind], ))
+
+
+def _checkHeader(header, kind):
+    if len(header) < HEADER_SIZE or header[:4] != MAGIC or header[4:5] != kind:
+        raise ValueError('not a file of MNAC {} records'.format(
+            'game' if kind == GAMES else 'snapshot'))
+    if header[5] != VERSIONS[kind]:
+        raise ValueError('unknown MNAC record version {}'.format(header[5]))
+
+
+class _Writer:
+    kind = None
+
+    def __init__(self, file):
+        '''Append to a path, or an open binary file.'''
+        self.owned = not hasattr(file, 'write')
+        self.file = open(file, 'a+b') if self.owned else file
+        self.file.seek(0, 2)
+        if self.file.tell() == 0:
+            self.file.write(_header(self.kind))
+        else:
+            self.file.seek(0)
+            _checkHeader(self.file.read(HEADER_SIZE), self.kind)
+            self.file.seek(0, 2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class GameWriter(_Writer):
+    '''Appends GameRecords to a game record file.'''
+    kind = GAMES
+
+    def write(self, record):
+        self.file.write(packGame(record))
+
+
+class SnapshotWriter(_Writer):
+    '''Appends positions of games to a snapshot file.'''
+    kind = SNAPSHOTS
+
+    def write(self, game):
+        self.file.write(packSnapshot(game))
+
+
+def _reading(file, kind):
+    '''Open file for reading (unless it already is), checking its header.'''
+    if hasattr(file, 'read'):
+        f = file
+    else:
+        f = open(file, 'rb', buffering=1 << 16)
+    _checkHeader(f.read(HEADER_SIZE), kind)
+    return f
+
+
+def readGames(file):
+    '''Iterate over the GameRecords in a path or open binary file.'''
+    f = _reading(file, GAMES)
+    try:
+        yield from iter(lambda: _readGame(f.read), None)
+    finally:
+        if f is not file:
+            f.close()
+
+
+def readSnapshots(file, start=0):
+    '''Iterate over the positions in a snapshot file, from the one
+    numbered start.'''
+    f = _reading(file, SNAPSHOTS)
+    size = SNAPSHOT.size
+    try:
+        f.seek(HEADER_SIZE + start * size)
+        for block in iter(lambda: f.read(size * 4096), b''):
+            if len(block) % size:
+                raise ValueError('truncated snapshot')
+            for fields in SNAPSHOT.iter_unpack(block):
+                yield _snapshot(fields)
+    finally:
+        if f is not file:
+            f.close()
+
+
+def countSnapshots(path):
+    '''Number of positions in a snapshot file, from its size.'''
+    with open(path, 'rb') as f:
+        _checkHeader(f.read(HEADER_SIZE), SNAPSHOTS)
+        return (f.seek(0, 2) - HEADER_SIZE) // SNAPSHOT.size
@@ -3,20 +3,34 @@ PIL-based renderer for a given MNAC scene.
 '''
 
 from ast import literal_eval
+from collections import OrderedDict
+import functools
+import marshal
+import math
 import os
 import re
 
-from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 
 import mnac
 
+# PIL is imported by _importPIL() when an ImageRender is first made
+Image = ImageDraw = ImageFont = None
+
 FONT = 'arial.ttf'
 
 is_dark = True
 
-with open('theme.less') as f:
-    file = f.read(-1)
+THEME_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'theme.less')
+
+# Bump when parseTheme's output changes, to ignore older caches
+THEME_CACHE_VERSION = 1
+
+_themes = None
+
+
+def parseTheme(text):
+    '''Themes from the text of a theme.less file.'''
     for a, b in (
         (r'/\*.+?\*/', ''),
         (r'\s+', ''),
@@ -24,9 +38,63 @@ with open('theme.less') as f:
         ('\.([a-z]+)\{', r'"\1":{'),
         ('\{color:(#[a-zA-Z0-9]+)\}', r'"\1"')
     ):
-        file = re.sub(a, b, file)
-
-    THEMES = literal_eval('{' + file + '}')
+        text = re.sub(a, b, text)
+    return literal_eval('{' + text + '}')
+
+
+def loadThemes(path=THEME_PATH):
+    '''Parsed themes from a theme.less file.
+
+    The parse is cached with marshal (like .pyc files, it needs no
+    imports to load) in __pycache__ beside the file, and redone
+    whenever the file's modification time or size changes.'''
+    stat = os.stat(path)
+    source = [stat.st_mtime_ns, stat.st_size]
+    folder, name = os.path.split(path)
+    cache = os.path.join(folder, '__pycache__', '{}.v{}.marshal'.format(
+        os.path.splitext(name)[0], THEME_CACHE_VERSION))
+    try:
+        with open(cache, 'rb') as f:
+            cached = marshal.load(f)
+        if cached['source'] == source:
+            return cached['themes']
+    except (OSError, EOFError, ValueError, TypeError, KeyError):
+        pass
+
+    with open(path) as f:
+        themes = parseTheme(f.read())
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        # write then rename, so other processes never see half a file
+        temp = '{}.{}'.format(cache, os.getpid())
+        with open(temp, 'wb') as f:
+            marshal.dump({'source': source, 'themes': themes}, f)
+        os.replace(temp, cache)
+    except OSError:
+        pass  # read-only install; parse again next time
+    return themes
+
+
+def getTheme(name):
+    '''Colours of a theme in theme.less, loaded on first use.'''
+    global _themes
+    if _themes is None:
+        _themes = loadThemes()
+    return _themes[name]
+
+
+def __getattr__(name):
+    # THEMES is loaded on first use
+    if name == 'THEMES':
+        getTheme('dark')
+        return _themes
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def _importPIL():
+    global Image, ImageDraw, ImageFont
+    if Image is None:
+        from PIL import Image, ImageDraw, ImageFont
 
 CORNER = np.array([
     (0, 0), (0, 50), (1, 41), (3, 32), (21, 9),
@@ -39,6 +107,112 @@ CROSS = np.array([
     (0, 8), (3.5, 4.5), (0, 1), (0, 0)]) / 9
 
 
+class SpriteCache:
+    '''Size-bounded LRU cache of rasterised glyph masks.
+
+    Sprites are single-channel 'L' masks, so one sprite serves every
+    colour; it is keyed by its shape, size and sub-pixel offset so that
+    pasting it gives the same pixels as drawing the glyph in place.'''
+
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self.sprites = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key, draw):
+        '''Return the sprite for key, calling draw() to make it if needed.'''
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.hits += 1
+            self.sprites.move_to_end(key)
+            return sprite
+        self.misses += 1
+        sprite = self.sprites[key] = draw()
+        if len(self.sprites) > self.maxsize:
+            self.sprites.popitem(last=False)
+        return sprite
+
+    def clear(self):
+        self.sprites.clear()
+        self.hits = self.misses = 0
+
+
+SPRITES = SpriteCache()
+
+
+@functools.lru_cache(maxsize=64)
+def loadFont(font, size):
+    return ImageFont.truetype(font, size)
+
+
+class Layout:
+    '''Board geometry for one size and offset.
+
+    Positions are precomputed for every grid and cell, as read-only
+    arrays indexed by grid (and then cell):
+
+    grids, cells: top left corners
+    noughts, gridNoughts: ellipse bounds of a nought mark
+    crosses, gridCrosses: polygon points of a cross mark
+    cellAnchors, gridAnchors: where numerals are placed'''
+
+    def __init__(self, size, separation=1/4, offset=(0, 0)):
+        self.size = size
+        self.separation = separation
+        self.offset = offset
+        cell = self.cell = size / (9 + 2 * separation)
+        # distance from one grid to the next
+        self.pitch = cell * (3 + separation)
+        self._scaled = {}
+
+        xy = np.array([(i % 3, i // 3) for i in range(9)])
+        grids = xy * cell * (3 + separation)
+        cells = grids[:, None] + (xy * cell)[None]
+        bounds = (*offset, *offset)
+
+        self.grids = grids + offset
+        self.cells = cells + offset
+        self.noughts = np.concatenate(
+            (cells + cell / 18, cells + cell - cell / 18), axis=2) + bounds
+        self.crosses = cells[:, :, None] + CROSS * cell + offset
+        self.cellAnchors = cells + cell / 2 + offset
+        self.gridNoughts = np.concatenate(
+            (grids + cell / 6, grids + cell * (3 - 1/6)), axis=1) + bounds
+        self.gridCrosses = grids[:, None] + (CROSS * cell * 3) + offset
+        self.gridAnchors = grids + cell * 6/9 + offset
+        for array in (self.grids, self.cells, self.noughts, self.crosses,
+                      self.cellAnchors, self.gridNoughts, self.gridCrosses,
+                      self.gridAnchors):
+            array.flags.writeable = False
+
+    def scaled(self, vector):
+        '''A vector in units of size / (9 + 2 * separation).'''
+        if vector not in self._scaled:
+            self._scaled[vector] = \
+                np.array(vector) * self.size / (9 + 2 * self.separation)
+        return self._scaled[vector]
+
+    def locate(self, x, y):
+        '''Return the (grid, cell) at a point, counting from 0, or None
+        if it is outside the board or between grids.'''
+        x -= self.offset[0]
+        y -= self.offset[1]
+        if not (0 <= x < self.size and 0 <= y < self.size):
+            return None
+        gx, x = divmod(x, self.pitch)
+        gy, y = divmod(y, self.pitch)
+        cx, cy = int(x // self.cell), int(y // self.cell)
+        if cx > 2 or cy > 2 or gx > 2 or gy > 2:
+            return None
+        return int(gy) * 3 + int(gx), cy * 3 + cx
+
+
+@functools.lru_cache(maxsize=16)
+def getLayout(size, separation=1/4, offset=(0, 0)):
+    '''Shared Layout for a size and offset.'''
+    return Layout(size, separation, offset)
+
+
 class Render:
     '''Generic render engine.'''
     def __init__(self, game, size=450, theme='dark'):
@@ -46,13 +220,19 @@ class Render:
             raise TypeError('Game must be MNAC or subclass')
         self.game = game
         self.size = size
-        self.theme = THEMES[theme]
+        self.theme = getTheme(theme)
         self.error = False
 
     # Relative to width of one cell, size of grid gaps
     SEPARATION = 1/4
     # Grid rounding, relative to cell width
     ROUNDING = 1/10
+    # Position of the board's top left
+    offset = (0, 0)
+
+    @property
+    def layout(self):
+        return getLayout(self.size, self.SEPARATION, self.offset)
 
     def background(self):
         players = ['', 'nought', 'cross', 'gray']
@@ -68,61 +248,52 @@ class Render:
 
         theme = self.theme
         game = self.game
-        cell = self.size / (9 + 2 * self.SEPARATION)
+        layout = self.layout
+        cell = layout.cell
 
         for g in range(9):
-            gxy = np.array((g % 3, g // 3))
-            gridtl = gxy * cell * (3 + self.SEPARATION)
+            if self.skipGrid(g):
+                continue
             gridStatus = game.gridStatus[g]
             gridTaken = (gridStatus in (1, 2))
 
-            if not gridTaken:
+            if not gridTaken and not self.skipCells(g):
                 for c in range(9):
                     gridcol = ['light', 'main', 'dark'][(g % 2) + (c % 2)]
                     color = theme['grid'][gridcol]
-                    xy = np.array((c % 3, c // 3))
-                    celltl = gridtl + (xy * cell)
-                    self.cell(g, c, celltl, cell, fill=color)
+                    self.cell(g, c, layout.cells[g, c], cell, fill=color)
 
                 # %% cell markers
                     cellStatus = game.grids[g][c]
-                    xy = np.array((c % 3, c // 3))
-                    celltl = gridtl + xy * cell
                     wasLast = (game.lastPlacedGrid,
                                game.lastPlacedCell) == (g, c)
                     if cellStatus == 1:
                         color = theme['cross']['light' if wasLast else 'main']
-                        top_left = celltl + cell / 18
-                        bottom_right = celltl + cell - cell / 18
-                        coords = np.array((*top_left, *bottom_right))
-                        self.ellipse(coords, outline=color, width=cell/9)
+                        self.ellipse(layout.noughts[g, c], outline=color,
+                                     width=cell/9)
 
                     elif cellStatus == 2:
-                        coords = celltl + CROSS * cell
                         color = theme['nought']['light' if wasLast else 'main']
-                        self.polygon(coords, fill=color)
+                        self.polygon(layout.crosses[g, c], fill=color)
 
                     elif game.grid == g and game.state == 'inner':
                         # keyboard selector for cell
                         canTeleport = (c == g or game.gridStatus[c] != 0)
                         textcol = theme['tele']['main'] if canTeleport else theme['gray']['dark']
                         self.text(
-                            celltl + cell/2, isLarge=False, fill=textcol,
+                            layout.cellAnchors[g, c], isLarge=False, fill=textcol,
                             size=int(cell * 2/3), text=str(mnac.numpad(c + 1))
                         )
 
             # %% grid markers - nought, cross
 
             if gridStatus == 1:
-                top_left = gridtl + cell / 6
-                bottom_right = gridtl + cell * (3 - 1/6)
-                coords = np.array((*top_left, *bottom_right))
-                self.ellipse(
-                    coords, outline=theme['cross']['light'], width=cell/3)
+                self.ellipse(layout.gridNoughts[g],
+                             outline=theme['cross']['light'], width=cell/3)
 
             elif gridStatus == 2:
-                coords = gridtl + (CROSS * cell * 3)
-                self.polygon(coords, fill=theme['nought']['light'])
+                self.polygon(layout.gridCrosses[g],
+                             fill=theme['nought']['light'])
 
             elif game.grid == g or gridStatus == 3:
                 pass
@@ -141,7 +312,7 @@ class Render:
 
                 if color:
                     self.text(
-                        gridtl + cell * 6/9, isLarge=True,
+                        layout.gridAnchors[g], isLarge=True,
                         text=str(mnac.numpad(g+1)), size=int(cell * 2),
                         fill=color)
 
@@ -162,6 +333,38 @@ class Render:
     def onStart(self):
         '''Callback before rendering starts.'''
 
+    def skipGrid(self, grid):
+        '''Return True to leave a grid as it was last drawn.'''
+        return False
+
+    def skipCells(self, grid):
+        '''Return True to leave a grid's cells as they were last drawn,
+        but still draw its grid marker.'''
+        return False
+
+    def gridKey(self, g):
+        '''Everything that affects how grid g is drawn, as a pair of
+        tuples for its cells and for its grid marker. If they are
+        unchanged between two draws, so is what they draw.'''
+        game = self.game
+        status = game.gridStatus[g]
+        cells = (status, tuple(game.grids[g]),
+                 game.lastPlacedCell if game.lastPlacedGrid == g else None)
+        if status in (1, 2):
+            # taken grids show the background around their marker
+            return cells + (self.background(), ), None
+        elif game.grid == g:
+            if game.state == 'inner':
+                # cell selector colours depend on every grid's status
+                return cells + (tuple(game.gridStatus), ), None
+            return cells, None
+        elif status == 3:
+            return cells, None
+        elif game.state == 'inner':
+            # colour of the grid selector, if shown
+            return cells, ('sends', not game.grids[game.grid][g])
+        return cells, ('picks', game.middleStart or game.state != 'begin' or g != 4)
+
     def cell(self, grid, cell, tl, size, fill):
         '''Draw a cell backing.'''
 
@@ -182,6 +385,11 @@ class ImageRender(Render):
     '''Python Imaging Library-based image renderer.'''
 
     font = 'arial.ttf'
+    sprites = SPRITES
+
+    def __init__(self, game, size=450, theme='dark'):
+        _importPIL()
+        super().__init__(game, size=size, theme=theme)
 
     def onStart(self):
         self.image = Image.new(
@@ -191,33 +399,158 @@ class ImageRender(Render):
     def cell(self, i, j, cell, size, fill):
         self.imdraw.rectangle((*cell, *(cell + size)), fill=fill)
 
+    def _paste(self, fill, origin, key, draw):
+        sprite = self.sprites.get(key, draw)
+        x, y = origin
+        self.image.paste(
+            fill, (x, y, x + sprite.width, y + sprite.height), mask=sprite)
+
     def ellipse(self, bounds, outline, width):
         # Totally stolen from Håken Lid! stackoverflow.com/a/34926008
 
-        # Single channel mask to apply colour with, initially black (transparent)
-        mask = Image.new(size=self.image.size, mode='L', color='black')
-        draw = ImageDraw.Draw(mask)
-
-        # draw outer shape in white (color) and inner shape in black (transparent)
+        # outer shape in white (color) and inner shape in black (transparent)
+        shapes = []
         for offset, fill in (width/-2.0, 'white'), (width/2.0, 'black'):
             left, top = [(value + offset) for value in bounds[:2]]
             right, bottom = [(value - offset-1) for value in bounds[2:]]
-            draw.ellipse([left, top, right, bottom], fill=fill)
-
-        self.image.paste(outline, mask=mask)
+            shapes.append(([left, top, right, bottom], fill))
+
+        # position of the sprite in the image; the shapes are drawn
+        # relative to it
+        outer = shapes[0][0]
+        ox, oy = math.floor(outer[0]), math.floor(outer[1])
+        shapes = tuple(
+            (tuple(float(v) - o for v, o in zip(box, (ox, oy, ox, oy))), fill)
+            for box, fill in shapes)
+
+        def draw():
+            # Single channel mask to apply colour with, initially black (transparent)
+            _, _, right, bottom = shapes[0][0]
+            mask = Image.new('L', (math.ceil(right) + 2, math.ceil(bottom) + 2))
+            draw = ImageDraw.Draw(mask)
+            for box, fill in shapes:
+                draw.ellipse(box, fill=fill)
+            return mask
+
+        self._paste(outline, (ox, oy), ('ellipse', shapes), draw)
 
     def polygon(self, coords, fill):
-        self.imdraw.polygon(tuple(coords.flatten()), fill=fill)
+        ox, oy = (math.floor(v) for v in coords.min(axis=0))
+        points = tuple((coords - (ox, oy)).flatten().tolist())
+
+        def draw():
+            mask = Image.new('L', tuple(
+                math.ceil(v) + 1 for v in coords.max(axis=0) - (ox, oy)))
+            ImageDraw.Draw(mask).polygon(points, fill='white')
+            return mask
+
+        self._paste(fill, (ox, oy), ('polygon', points), draw)
 
     def text(self, coords, isLarge, text, size, fill):
         # fiddle factors for text coords
         fiddle = (1/3, -1/6) if isLarge else (-1/6, -1/3)
-        coords += np.array(fiddle) * self.size / (9 + 2 * self.SEPARATION)
+        coords = coords + self.layout.scaled(fiddle)
+
+        font = loadFont(self.font, size)
+        ox, oy = (math.floor(v) for v in coords)
+        offset = tuple((coords - (ox, oy)).tolist())
+
+        def draw():
+            _, _, right, bottom = font.getbbox(text)
+            mask = Image.new('L', (right + 2, bottom + 2))
+            ImageDraw.Draw(mask).text(offset, text=text, font=font, fill='white')
+            return mask
+
+        self._paste(fill, (ox, oy), ('text', self.font, size, text, offset), draw)
+
+    def drawn(self):
+        return self.image
+
+
+class IncrementalImageRender(ImageRender):
+    '''ImageRender that keeps its last frame between calls to draw(),
+    and only redraws the grids whose appearance has changed since.
+
+    The output is identical to a full ImageRender, but the same image
+    is updated in place by each draw, so copy it if it must be kept.'''
+
+    def __init__(self, game, size=450, theme='dark'):
+        super().__init__(game, size=size, theme=theme)
+        self.previous = None  # (background, grid keys) of the last frame
+        self.tiles, self.gaps = self._tiles()
+
+    def _tiles(self):
+        '''Pixel box covered by each grid's cells as drawn by Render,
+        and boxes covering the background between them.'''
+        layout = self.layout
+        tiles = []
+        for g in range(9):
+            mask = Image.new('L', (self.size, self.size))
+            draw = ImageDraw.Draw(mask)
+            for celltl in layout.cells[g]:
+                draw.rectangle((*celltl, *(celltl + layout.cell)), fill='white')
+            tiles.append(mask.getbbox())
+
+        # grids are aligned in rows and columns, so the background is
+        # the strips before, between and after them
+        gaps = []
+        for axis in (0, 1):
+            edges = [0] + [e for i in range(3) for e in (
+                tiles[i * (1 + 2 * axis)][axis],
+                tiles[i * (1 + 2 * axis)][axis + 2])] + [self.size]
+            for start, end in zip(edges[::2], edges[1::2]):
+                if start < end:
+                    box = [0, 0, self.size - 1, self.size - 1]
+                    box[axis], box[axis + 2] = start, end - 1
+                    gaps.append(tuple(box))
+        return tiles, gaps
+
+    def onStart(self):
+        self.keys = [self.gridKey(g) for g in range(9)]
+        self.restored = [False] * 9
+        if self.previous is None:
+            self.cellTiles = [None] * 9
+            return super().onStart()
+
+        background = self.background()
+        if background != self.previous[0]:
+            for box in self.gaps:
+                self.imdraw.rectangle(box, fill=background)
+        for g, box in enumerate(self.tiles):
+            key = self.keys[g]
+            if self.skipGrid(g):
+                continue
+            saved = self.cellTiles[g]
+            if saved is not None and saved[0] == key[0]:
+                # only the grid marker changed
+                self.image.paste(saved[1], box)
+                self.restored[g] = True
+            else:
+                x1, y1, x2, y2 = box
+                self.imdraw.rectangle((x1, y1, x2 - 1, y2 - 1), fill=background)
+
+    def skipGrid(self, grid):
+        self.drawing = grid
+        return self.previous is not None and \
+            self.previous[1][grid] == self.keys[grid]
+
+    def skipCells(self, grid):
+        return self.restored[grid]
+
+    def text(self, coords, isLarge, text, size, fill):
+        g = self.drawing
+        if isLarge and not self.restored[g]:
+            # grid markers are drawn over the cells, so keep the cells
+            # to restore when only the marker changes
+            self.cellTiles[g] = (self.keys[g][0], self.image.crop(self.tiles[g]))
+        super().text(coords, isLarge, text, size, fill)
 
-        font = ImageFont.truetype(self.font, size)
-        self.imdraw.text(coords, text=text, font=font, fill=fill)
+    def reset(self):
+        '''Forget the last frame, so the next draw is a full redraw.'''
+        self.previous = None
 
     def drawn(self):
+        self.previous = (self.background(), self.keys)
         return self.image
 
 
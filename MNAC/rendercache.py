@@ -0,0 +1,276 @@
+'''Cached PNG renders of positions, for bots and servers.
+
+Renders are keyed by what they show: the position's Zobrist key, the
+last cell placed (which is highlighted) and the winner, with the size,
+theme and error flag. Encoded PNGs are kept in a size-bounded LRU in
+memory, and those it evicts can be kept in a directory, named by
+their key, for this and later runs.
+
+Misses go to a process pool, which reads the render from the directory
+if it is there and renders it otherwise, and evicted renders are
+written out by a thread, so submit() never touches the disk. A request
+for a render that is already in flight waits on the same job instead
+of starting another.
+
+    cache = RenderCache(directory='renders')
+    png = cache.render(game)
+    png = await asyncio.wrap_future(cache.submit(game, size=300))
+'''
+
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+import io
+import os
+import queue
+import threading
+import time
+import zlib
+
+import instrument
+import record
+import render
+
+RenderKey = namedtuple('RenderKey', 'key last winner size theme error')
+
+# Completed renders kept for the latency percentiles
+LATENCY_SAMPLES = 1024
+
+
+def renderKey(game, size=450, theme='dark', error=False):
+    '''Everything an ImageRender of a game depends on.'''
+    last = (-1 if game.lastPlacedGrid is None
+            else game.lastPlacedGrid * 9 + game.lastPlacedCell)
+    return RenderKey(game.key, last, game.winner, size, theme, bool(error))
+
+
+_styles = {}
+
+
+def _style(theme, font):
+    '''Short digest of a theme and font, so files on disk are not
+    reused after either changes.'''
+    style = _styles.get((theme, font))
+    if style is None:
+        style = _styles[theme, font] = zlib.crc32(repr(
+            (sorted(render.getTheme(theme).items()), font)).encode())
+    return style
+
+
+def renderPath(directory, key, font=None):
+    '''Path of the file for a RenderKey in a directory.'''
+    return os.path.join(directory, '{:016x}-{}-{}-{}-{}-{:08x}{}.png'.format(
+        key.key, key.last, key.winner, key.size, key.theme,
+        _style(key.theme, font), '-error' if key.error else ''))
+
+
+def loadOrRender(snapshot, key, directory=None, font=None):
+    '''PNG bytes for a RenderKey, from the directory if they are there,
+    and whether they were.'''
+    if directory:
+        try:
+            with open(renderPath(directory, key, font), 'rb') as f:
+                return f.read(), True
+        except FileNotFoundError:
+            pass
+    return renderSnapshot(snapshot, key.size, key.theme, key.error, font), False
+
+
+def renderSnapshot(snapshot, size, theme, error, font=None):
+    '''PNG bytes of the position in a record snapshot.'''
+    renderer = instrument.classFor(render.ImageRender)(
+        record.unpackSnapshot(snapshot), size=size, theme=theme)
+    renderer.error = error
+    if font:
+        renderer.font = font
+    image = renderer.draw()
+    out = io.BytesIO()
+    with instrument.timer('png.encode'):
+        image.save(out, 'PNG')
+    return out.getvalue()
+
+
+def _percentile(samples, p):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class RenderCache:
+    '''PNG renders of positions through an LRU, a directory and a pool.
+
+    Pass an executor to share one with other work; otherwise a process
+    pool is started on the first miss. submit() and render() may be
+    called from any thread.'''
+
+    def __init__(self, maxBytes=64 << 20, directory=None, executor=None,
+                 processes=None, font=None):
+        self.maxBytes = maxBytes
+        self.directory = directory
+        self.executor = executor
+        self.ownsExecutor = executor is None
+        self.processes = processes
+        self.font = font
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.pending = {}
+        # keys of entries that are already in the directory
+        self.onDisk = set()
+        self.lock = threading.Lock()
+        # renders to write to the directory, and the thread writing them
+        self.spills = queue.Queue()
+        self.writer = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.writer = threading.Thread(
+                target=self._write, name='rendercache', daemon=True)
+            self.writer.start()
+
+        self.requests = self.hits = self.diskHits = self.joined = 0
+        self.renders = self.failures = 0
+        self.renderTime = 0.0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def path(self, key):
+        return renderPath(self.directory, key, self.font)
+
+    # %% lookup
+
+    def submit(self, game, size=450, theme='dark', error=False):
+        '''Future of the PNG bytes of a game's position.'''
+        key = renderKey(game, size, theme, error)
+        with self.lock:
+            self.requests += 1
+            data = self.entries.get(key)
+            if data is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self._done(data)
+            future = self.pending.get(key)
+            if future is not None:
+                self.joined += 1
+                return future
+            future = self.pending[key] = Future()
+
+        start = time.perf_counter()
+        try:
+            job = self._executor().submit(
+                loadOrRender, record.packSnapshot(game), key, self.directory,
+                self.font)
+        except Exception as e:
+            with self.lock:
+                del self.pending[key]
+                self.failures += 1
+            future.set_exception(e)
+            return future
+        job.add_done_callback(lambda job: self._finished(key, job, start))
+        return future
+
+    def render(self, game, size=450, theme='dark', error=False):
+        '''PNG bytes of a game's position, waiting for any render.'''
+        return self.submit(game, size, theme, error).result()
+
+    @staticmethod
+    def _done(data):
+        future = Future()
+        future.set_result(data)
+        return future
+
+    def _executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.processes)
+        return self.executor
+
+    def _finished(self, key, job, start):
+        # cancelled jobs, as by shutdown(cancel_futures=True), have no
+        # exception() to ask for: it raises
+        error = CancelledError() if job.cancelled() else job.exception()
+        with self.lock:
+            future = self.pending.pop(key)
+            if error is None:
+                data, fromDisk = job.result()
+                if fromDisk:
+                    self.diskHits += 1
+                else:
+                    elapsed = time.perf_counter() - start
+                    self.renders += 1
+                    self.renderTime += elapsed
+                    self.latencies.append(elapsed)
+                self._store(key, data, spill=not fromDisk)
+            else:
+                self.failures += 1
+        if error is None:
+            future.set_result(data)
+        else:
+            future.set_exception(error)
+
+    # %% storage
+
+    def _store(self, key, data, spill=True):
+        '''Add a render to the LRU, evicting old ones to be written out.
+        A render read from the directory need not be written again.
+        Called with the lock held.'''
+        self.entries[key] = data
+        self.bytes += len(data)
+        if not spill:
+            self.onDisk.add(key)
+        while self.bytes > self.maxBytes and len(self.entries) > 1:
+            old, oldData = self.entries.popitem(last=False)
+            self.bytes -= len(oldData)
+            if self.writer is not None and old not in self.onDisk:
+                self.spills.put((old, oldData))
+            self.onDisk.discard(old)
+
+    def _write(self):
+        while True:
+            key, data = self.spills.get()
+            try:
+                path = self.path(key)
+                if not os.path.exists(path):
+                    temp = '{}.{}.tmp'.format(path, os.getpid())
+                    with open(temp, 'wb') as f:
+                        f.write(data)
+                    os.replace(temp, path)
+            except OSError:
+                pass  # the directory is only a cache
+            finally:
+                self.spills.task_done()
+
+    def flush(self):
+        '''Write every render held in memory to the directory, and wait
+        for every write.'''
+        if self.writer is None:
+            return
+        with self.lock:
+            for key, data in self.entries.items():
+                if key not in self.onDisk:
+                    self.spills.put((key, data))
+                    self.onDisk.add(key)
+        self.spills.join()
+
+    def close(self):
+        '''Flush, and stop the process pool if this cache started it.'''
+        self.flush()
+        if self.ownsExecutor and self.executor is not None:
+            self.executor.shutdown()
+
+    # %% counters
+
+    def stats(self):
+        '''Request counts, hit rate and render latency in seconds.'''
+        with self.lock:
+            requests = self.requests
+            return {
+                'requests': requests,
+                'hits': self.hits,
+                'diskHits': self.diskHits,
+                'joined': self.joined,
+                'renders': self.renders,
+                'failures': self.failures,
+                'hitRate': (self.hits + self.diskHits + self.joined) / (requests or 1),
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'meanRender': self.renderTime / (self.renders or 1),
+                'p50Render': _percentile(self.latencies, 50),
+                'p99Render': _percentile(self.latencies, 99),
+            }
@@ -0,0 +1,320 @@
+'''Render replays of games as animated GIF or APNG, or numbered PNGs.
+
+A replay is a sequence of play() indices, with one frame for the
+starting position and one after each of them. Frames are rendered in
+chunks on a process pool, each chunk with an IncrementalImageRender,
+and each is reduced to one shared palette and cropped to the region
+that changed since the frame before it. Finished chunks are written
+out in order as they arrive, so only a few are held at once.
+
+    python replay.py game.txt replay.gif --size 450 -p 8
+
+Game files hold moves as typed into the terminal frontend (numpad
+digits or directions), separated by spaces or newlines.
+'''
+
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import io
+import os
+import random
+import struct
+import sys
+import zlib
+
+from PIL import Image, ImageChops, GifImagePlugin
+
+import instrument
+import mnac
+import render
+
+FORMATS = ('gif', 'apng', 'png')
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def formatFor(path):
+    '''Output format implied by a path: 'png' for numbered PNGs (a
+    path with a {} field for the frame number), or by its extension.'''
+    if '{' in path:
+        return 'png'
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.gif':
+        return 'gif'
+    elif ext in ('.png', '.apng'):
+        return 'apng'
+    raise ValueError('cannot tell replay format from {!r}'.format(path))
+
+
+def _renderer(game, size, theme, font):
+    renderer = instrument.classFor(render.IncrementalImageRender)(
+        game, size=size, theme=theme)
+    if font:
+        renderer.font = font
+    return renderer
+
+
+@functools.lru_cache(maxsize=8)
+def palette(size=450, theme='dark', font=None):
+    '''Shared 256 colour palette for frames of this size and theme,
+    as a flat list of RGB values.
+
+    It is quantised once from sample games ending in each result, so
+    that it covers every background and the antialiased edges.'''
+    samples = []
+    rand = random.Random(size)
+    winners = set()
+    while len(winners) < 3:
+        game = mnac.MNAC()
+        renderer = _renderer(game, size, theme, font)
+        while not game.winner:
+            moves = game.legalMoves()
+            game.make(rand.choice(moves))
+        if game.winner in winners:
+            continue
+        winners.add(game.winner)
+        samples.append(renderer.draw().copy())
+
+    sheet = Image.new('RGB', (size, size * len(samples)))
+    for i, sample in enumerate(samples):
+        sheet.paste(sample, (0, i * size))
+    colours = sheet.quantize(256, method=Image.Quantize.MEDIANCUT).getpalette()
+    return colours + [0] * (768 - len(colours))
+
+
+def _paletteImage(colours):
+    image = Image.new('P', (1, 1))
+    image.putpalette(colours)
+    return image
+
+
+def _pngChunks(data):
+    '''(type, body) of each chunk of a PNG file.'''
+    i = len(PNG_SIGNATURE)
+    while i < len(data):
+        length, kind = struct.unpack('>I4s', data[i:i + 8])
+        yield kind, data[i + 8:i + 8 + length]
+        i += 12 + length
+
+
+def _pngChunk(kind, body):
+    return (struct.pack('>I', len(body)) + kind + body +
+            struct.pack('>I', zlib.crc32(kind + body)))
+
+
+def _encode(image, box, fmt, duration):
+    '''Encoded frame for one of FORMATS; image is already cropped to box.'''
+    if fmt == 'gif':
+        return box, b''.join(GifImagePlugin.getdata(
+            image, box[:2], duration=duration, disposal=1))
+    out = io.BytesIO()
+    with instrument.timer('png.encode'):
+        image.save(out, 'PNG')
+    if fmt == 'png':
+        return box, out.getvalue()
+    return box, b''.join(
+        body for kind, body in _pngChunks(out.getvalue()) if kind == b'IDAT')
+
+
+def renderChunk(steps, start, stop, fmt, size=450, theme='dark', font=None,
+                colours=None, duration=500):
+    '''Encoded frames start to stop - 1 of a replay.
+
+    Frame i is the position after the first i steps. For GIF and APNG,
+    each is cropped to where it differs from the frame before.'''
+    game = mnac.MNAC()
+    for i in steps[:max(start - 1, 0)]:
+        game.play(i)
+    renderer = _renderer(game, size, theme, font)
+    paletteImage = _paletteImage(colours or palette(size, theme, font))
+
+    previous = renderer.draw().copy() if start else None
+    frames = []
+    for n in range(start, stop):
+        if n:
+            game.play(steps[n - 1])
+        image = renderer.draw()
+        if previous is None or fmt == 'png':
+            box = (0, 0, size, size)
+        else:
+            # unchanged frames still need a pixel to hold their delay
+            box = ImageChops.difference(previous, image).getbbox() or (0, 0, 1, 1)
+        previous = image.copy()
+        frame = image.crop(box).quantize(
+            palette=paletteImage, dither=Image.Dither.NONE)
+        frames.append(_encode(frame, box, fmt, duration))
+    return frames
+
+
+class GifWriter:
+    '''Writes frames from renderChunk to an animated GIF.'''
+
+    def __init__(self, fp, size, colours, loop=0):
+        self.fp = fp
+        first = Image.new('P', (size, size))
+        first.putpalette(colours)
+        header, _ = GifImagePlugin.getheader(
+            first, info={'loop': loop, 'duration': 1, 'optimize': False})
+        fp.write(b''.join(header))
+
+    def write(self, box, data):
+        self.fp.write(data)
+
+    def close(self):
+        self.fp.write(b';')
+
+
+class ApngWriter:
+    '''Writes frames from renderChunk to an animated PNG. The first
+    frame is the default image shown by viewers without APNG support.'''
+
+    def __init__(self, fp, size, colours, frames, loop=0, duration=500):
+        self.fp = fp
+        self.frame = 0
+        self.sequence = 0
+        self.duration = duration
+        fp.write(PNG_SIGNATURE)
+        fp.write(_pngChunk(b'IHDR', struct.pack(
+            '>IIBBBBB', size, size, 8, 3, 0, 0, 0)))
+        fp.write(_pngChunk(b'PLTE', bytes(colours)))
+        fp.write(_pngChunk(b'acTL', struct.pack('>II', frames, loop)))
+
+    def write(self, box, data):
+        x1, y1, x2, y2 = box
+        self.fp.write(_pngChunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', self.sequence, x2 - x1, y2 - y1, x1, y1,
+            self.duration, 1000, 0, 0)))
+        self.sequence += 1
+        if self.frame == 0:
+            self.fp.write(_pngChunk(b'IDAT', data))
+        else:
+            self.fp.write(_pngChunk(
+                b'fdAT', struct.pack('>I', self.sequence) + data))
+            self.sequence += 1
+        self.frame += 1
+
+    def close(self):
+        self.fp.write(_pngChunk(b'IEND', b''))
+
+
+class PngWriter:
+    '''Writes frames from renderChunk to numbered PNG files.'''
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.frame = 0
+
+    def write(self, box, data):
+        with open(self.pattern.format(self.frame), 'wb') as f:
+            f.write(data)
+        self.frame += 1
+
+    def close(self):
+        pass
+
+
+def chunks(steps, fmt, size, theme, font, colours, duration, chunkSize):
+    '''Arguments of renderChunk for each chunk of a replay.'''
+    frames = len(steps) + 1
+    for start in range(0, frames, chunkSize):
+        yield (steps, start, min(start + chunkSize, frames), fmt, size,
+               theme, font, colours, duration)
+
+
+def replay(steps, path, size=450, theme='dark', duration=500, loop=0,
+           processes=None, chunkSize=16, font=None, fmt=None):
+    '''Render a replay of play() indices to path.
+
+    The format is taken from the path unless given; see formatFor.
+    processes=1 renders every chunk in this process.'''
+    steps = list(steps)
+    fmt = fmt or formatFor(path)
+    if fmt not in FORMATS:
+        raise ValueError('format must be one of ' + ', '.join(FORMATS))
+    colours = palette(size, theme, font)
+    frames = len(steps) + 1
+
+    fp = None
+    if fmt == 'png':
+        writer = PngWriter(path)
+    else:
+        fp = open(path, 'wb')
+        if fmt == 'gif':
+            writer = GifWriter(fp, size, colours, loop)
+        else:
+            writer = ApngWriter(fp, size, colours, frames, loop, duration)
+
+    try:
+        work = chunks(steps, fmt, size, theme, font, colours, duration,
+                      chunkSize)
+        if processes == 1:
+            for args in work:
+                for frame in renderChunk(*args):
+                    writer.write(*frame)
+        else:
+            processes = processes or os.cpu_count()
+            with ProcessPoolExecutor(processes) as pool:
+                # keep a bounded number of chunks in flight, and write
+                # them out in order
+                pending = deque()
+                for args in work:
+                    if len(pending) >= processes * 2:
+                        for frame in pending.popleft().result():
+                            writer.write(*frame)
+                    pending.append(pool.submit(renderChunk, *args))
+                while pending:
+                    for frame in pending.popleft().result():
+                        writer.write(*frame)
+        writer.close()
+    finally:
+        if fp is not None:
+            fp.close()
+    return frames
+
+
+def readSteps(f):
+    '''play() indices from moves as typed into the terminal frontend.'''
+    steps = []
+    for token in f.read().split():
+        index = mnac.getIndex(token)
+        if index is None:
+            raise ValueError('not a move: {!r}'.format(token))
+        steps.append(index + 1)
+    return steps
+
+
+parser = argparse.ArgumentParser(
+    description='Render a replay of a game of MNAC.')
+parser.add_argument('game', help="File of moves, or '-' for stdin.")
+parser.add_argument('output', help=(
+    'Output .gif or .png (animated), or a pattern such as '
+    'frames/{:03}.png for numbered PNGs.'))
+parser.add_argument('--size', type=int, default=450)
+parser.add_argument('--theme', default='dark',
+                    help='Theme in theme.less (default: dark).')
+parser.add_argument('--duration', type=int, default=500,
+                    help='Milliseconds per frame.')
+parser.add_argument('--loop', type=int, default=0,
+                    help='Times to play the animation (0 = forever).')
+parser.add_argument('-p', '--processes', type=int, default=None,
+                    help='Worker processes (default: one per CPU).')
+parser.add_argument('--chunk-size', dest='chunkSize', type=int, default=16,
+                    help='Frames rendered by each task.')
+parser.add_argument('--font', default=None,
+                    help='TrueType font for numerals.')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    # checked here, not with choices, so importing replay loads no themes
+    if args.theme not in render.THEMES:
+        parser.error('unknown theme {!r}; pick from {}'.format(
+            args.theme, ', '.join(sorted(render.THEMES))))
+    if args.game == '-':
+        steps = readSteps(sys.stdin)
+    else:
+        with open(args.game) as f:
+            steps = readSteps(f)
+    replay(steps, args.output, args.size, args.theme, args.duration,
+           args.loop, args.processes, args.chunkSize, args.font)
@@ -0,0 +1,381 @@
+'''Asyncio server hosting many games of Meta Noughts and Crosses.
+
+Clients speak a line protocol over TCP. Each command is one line of
+words, and every command gets exactly one reply line, in order:
+
+    NEW [nomiddle] [computer]   GAME <id> <seat>      start a game
+    JOIN <id>                   GAME <id> <seat>      take a free seat
+    PLAY <id> <move>            STATE ...             play for your seat
+    STATE <id>                  STATE ...
+    HINT <id>                   HINT <id> <move>      engine suggestion
+    RENDER <id> [size]          PNG <id> <base64>
+    STATS                       STATS <name>=<value> ...
+    QUIT                        BYE
+
+Moves are anything mnac.getIndex understands: numpad digits, or
+directions such as 'nw' or 'top left'. Failures are answered with
+`ERROR <code> <message>`, using the codes of mnac.ERRORS for illegal
+moves. Seat 1 plays noughts and seat 2 crosses; a `computer` game has
+the engine in seat 2.
+
+A state is `STATE <id> <moves> <player> <state> <grid> <winner> <cells>
+<statuses>`, where state is b, i or o (begin, inner, outer), grid is
+0-8 or -, cells is the 81 cell statuses grid by grid and statuses
+the 9 grid statuses. When someone moves, the other seat's connection
+is sent the same state as `UPDATE ...`, and games left idle are
+dropped with `EXPIRED <id>`; these lines arrive between replies.
+
+Searches and renders run on a process pool, so the event loop only
+ever parses, plays and formats. Renders go through a
+rendercache.RenderCache, so a position is only rendered once.
+
+    python server.py --port 4040 --idle 600
+'''
+
+import argparse
+import asyncio
+import base64
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import signal
+
+import bitboard
+import engine
+import instrument
+import mnac
+import record
+import rendercache
+
+ERRORS = {
+    40: 'Unknown command.',
+    41: 'No such game.',
+    42: 'Not your turn.',
+    43: 'That game is full.',
+    44: 'Not a move.',
+    45: 'That game is over.',
+    46: 'Bad argument.',
+    50: 'Server error.',
+}
+
+STATES = {'begin': 'b', 'inner': 'i', 'outer': 'o'}
+
+# statuses 0-3 as the digits '0'-'3'
+DIGITS = bytes.maketrans(bytes(range(4)), b'0123')
+
+# Bytes queued for a client that is not reading before it is dropped
+MAX_BUFFER = 1 << 20
+
+MAX_RENDER_SIZE = 1200
+
+
+class CommandError(Exception):
+    __slots__ = ('code', )
+
+    def __init__(self, code):
+        self.code = code
+
+    def __str__(self):
+        return ERRORS.get(self.code) or mnac.ERRORS.get(self.code, 'Unknown error')
+
+
+def formatState(gameId, game):
+    '''Words of a game's state, after the STATE or UPDATE tag.'''
+    return '{} {} {} {} {} {} {} {}'.format(
+        gameId, game.moves, game.player, STATES[game.state],
+        '-' if game.grid is None else game.grid, game.winner,
+        bytes(itertools.chain.from_iterable(game.grids)).translate(DIGITS).decode(),
+        bytes(game.gridStatus).translate(DIGITS).decode())
+
+
+# %% process pool work
+
+_engine = None
+
+
+def think(played, timeLimit):
+    '''play() indices of the engine's turn in a record.GameRecord.'''
+    global _engine
+    if _engine is None:
+        _engine = engine.Engine()
+    game = played.replay(bitboard.BitMNAC)
+    move = _engine.search(game, timeLimit).move
+    return [] if move is None else game.steps(move)
+
+
+# %% server
+
+class Game:
+    '''A hosted game, its seats and its record.'''
+
+    def __init__(self, gameId, middleStart, computer, now):
+        self.id = gameId
+        self.game = instrument.classFor(mnac.MNAC)(middleStart=middleStart)
+        self.record = record.GameRecord.start(self.game)
+        self.computer = computer
+        # seats[player] is the Client in that seat, if any
+        self.seats = [None, None, None]
+        self.thinking = False
+        self.touched = now
+
+    def freeSeat(self):
+        for seat in (1, 2):
+            if self.seats[seat] is None and not (seat == 2 and self.computer):
+                return seat
+        return None
+
+    def play(self, index):
+        self.game.play(index)
+        self.record.steps.append(index)
+
+    def played(self):
+        '''Copy of the record to hand to the process pool, which
+        pickles it some time after it is submitted.'''
+        return self.record._replace(steps=list(self.record.steps))
+
+
+class Client:
+    '''One connection, and the games it has seats in.'''
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.seats = {}  # game id: seat
+
+    def send(self, line):
+        '''Queue a line without waiting, dropping clients that have
+        stopped reading.'''
+        if self.writer.is_closing():
+            return
+        self.writer.write(line.encode() + b'\n')
+        if self.writer.transport.get_write_buffer_size() > MAX_BUFFER:
+            self.writer.close()
+
+
+class Server:
+    '''Hosts games for any number of clients.'''
+
+    def __init__(self, idle=600, thinkTime=0.5, workers=None,
+                 renderBytes=64 << 20, renderDirectory=None):
+        self.idle = idle
+        self.thinkTime = thinkTime
+        self.games = {}
+        self.ids = itertools.count(1)
+        self.pool = ProcessPoolExecutor(workers)
+        self.renders = rendercache.RenderCache(
+            renderBytes, renderDirectory, executor=self.pool)
+        self.clients = set()
+        self.commands = {
+            'NEW': self.new, 'JOIN': self.join, 'PLAY': self.play,
+            'STATE': self.state, 'HINT': self.hint, 'RENDER': self.render,
+            'STATS': self.stats,
+        }
+
+    async def serve(self, host='127.0.0.1', port=4040):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.connected, host, port)
+        reaper = asyncio.create_task(self.reap())
+        # stop cleanly when terminated, so the pool's workers go too
+        serving = asyncio.current_task()
+        try:
+            self.loop.add_signal_handler(signal.SIGTERM, serving.cancel)
+        except NotImplementedError:
+            pass  # Windows
+        try:
+            async with server:
+                try:
+                    await server.serve_forever()
+                except asyncio.CancelledError:
+                    # drop clients, so closing the server need not wait
+                    for client in list(self.clients):
+                        client.writer.close()
+        finally:
+            reaper.cancel()
+            self.renders.flush()
+            self.pool.shutdown(cancel_futures=True)
+
+    async def connected(self, reader, writer):
+        client = Client(self, reader, writer)
+        self.clients.add(client)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                words = line.decode(errors='replace').split()
+                if not words:
+                    continue
+                command = words[0].upper()
+                if command == 'QUIT':
+                    client.send('BYE')
+                    break
+                try:
+                    handler = self.commands.get(command)
+                    if handler is None:
+                        raise CommandError(40)
+                    reply = handler(client, words[1:])
+                    if asyncio.iscoroutine(reply):
+                        reply = await reply
+                except (CommandError, mnac.MoveError) as e:
+                    reply = 'ERROR {} {}'.format(e.code, e)
+                client.send(reply)
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # ValueError: a line longer than the stream limit
+            pass
+        finally:
+            self.clients.discard(client)
+            for gameId, seat in client.seats.items():
+                hosted = self.games.get(gameId)
+                if hosted is not None:
+                    hosted.seats[seat] = None
+            writer.close()
+
+    def _game(self, words):
+        try:
+            hosted = self.games[int(words[0])]
+        except (IndexError, ValueError, KeyError):
+            raise CommandError(41)
+        hosted.touched = self.loop.time()
+        return hosted
+
+    def _seat(self, client, hosted, seat):
+        hosted.seats[seat] = client
+        client.seats[hosted.id] = seat
+        return 'GAME {} {}'.format(hosted.id, seat)
+
+    async def _offload(self, function, *args):
+        '''Run a function on the process pool.'''
+        try:
+            return await self.loop.run_in_executor(self.pool, function, *args)
+        except Exception:
+            raise CommandError(50)
+
+    def _moved(self, hosted, state, mover=None):
+        '''Tell every seat but the mover's connection of a new state.'''
+        update = 'UPDATE ' + state
+        for client in set(hosted.seats[1:]):
+            if client is not None and client is not mover:
+                client.send(update)
+
+    # %% commands
+
+    def new(self, client, words):
+        options = {word.lower() for word in words}
+        hosted = Game(next(self.ids), 'nomiddle' not in options,
+                      'computer' in options, self.loop.time())
+        self.games[hosted.id] = hosted
+        return self._seat(client, hosted, 1)
+
+    def join(self, client, words):
+        hosted = self._game(words)
+        seat = hosted.freeSeat()
+        if seat is None:
+            raise CommandError(43)
+        return self._seat(client, hosted, seat)
+
+    def play(self, client, words):
+        hosted = self._game(words)
+        game = hosted.game
+        if game.winner:
+            raise CommandError(45)
+        if hosted.seats[game.player] is not client or hosted.thinking:
+            raise CommandError(42)
+        index = mnac.getIndex(''.join(words[1:]))
+        if index is None:
+            raise CommandError(44)
+        hosted.play(index + 1)
+        state = formatState(hosted.id, game)
+        self._moved(hosted, state, client)
+        if hosted.computer and game.player == 2 and not game.winner:
+            hosted.thinking = True
+            asyncio.create_task(self.computerTurn(hosted))
+        return 'STATE ' + state
+
+    def state(self, client, words):
+        hosted = self._game(words)
+        return 'STATE ' + formatState(hosted.id, hosted.game)
+
+    async def hint(self, client, words):
+        hosted = self._game(words)
+        if hosted.game.winner:
+            raise CommandError(45)
+        steps = await self._offload(
+            think, hosted.played(), self.thinkTime)
+        return 'HINT {} {}'.format(
+            hosted.id, ' '.join(mnac.DIRECTIONS[i - 1][0] for i in steps))
+
+    async def render(self, client, words):
+        hosted = self._game(words)
+        try:
+            size = int(words[1]) if len(words) > 1 else 450
+        except ValueError:
+            raise CommandError(46)
+        size = max(90, min(size, MAX_RENDER_SIZE))
+        try:
+            data = await asyncio.wrap_future(
+                self.renders.submit(hosted.game, size))
+        except Exception:
+            raise CommandError(50)
+        return 'PNG {} {}'.format(hosted.id, base64.b64encode(data).decode())
+
+    def stats(self, client, words):
+        stats = {'games': len(self.games), 'clients': len(self.clients)}
+        stats.update(('render.' + k, v)
+                     for k, v in self.renders.stats().items())
+        return 'STATS ' + ' '.join(
+            '{}={:.4g}'.format(k, v) if isinstance(v, float) else
+            '{}={}'.format(k, v) for k, v in stats.items())
+
+    async def computerTurn(self, hosted):
+        try:
+            steps = await self._offload(
+                think, hosted.played(), self.thinkTime)
+            if self.games.get(hosted.id) is hosted:
+                for i in steps:
+                    hosted.play(i)
+                hosted.touched = self.loop.time()
+                self._moved(hosted, formatState(hosted.id, hosted.game))
+        except CommandError:
+            # the computer's seat is stuck; leave the game to expire
+            pass
+        finally:
+            hosted.thinking = False
+
+    async def reap(self):
+        '''Drop games no one has touched for `idle` seconds.'''
+        while True:
+            await asyncio.sleep(min(self.idle / 4, 60))
+            cutoff = self.loop.time() - self.idle
+            for gameId, hosted in list(self.games.items()):
+                if hosted.touched < cutoff and not hosted.thinking:
+                    del self.games[gameId]
+                    for client in set(hosted.seats[1:]):
+                        if client is not None:
+                            client.seats.pop(gameId, None)
+                            client.send('EXPIRED {}'.format(gameId))
+
+
+parser = argparse.ArgumentParser(
+    description='Host games of MNAC over TCP.')
+parser.add_argument('--host', default='127.0.0.1')
+parser.add_argument('--port', type=int, default=4040)
+parser.add_argument('--idle', type=float, default=600,
+                    help='Seconds before an untouched game is dropped.')
+parser.add_argument('--think', type=float, default=0.5,
+                    help='Seconds the engine may spend on a turn.')
+parser.add_argument('-p', '--processes', type=int, default=None,
+                    help='Worker processes for the engine and renders.')
+parser.add_argument('--render-cache', dest='renderBytes', type=int,
+                    default=64 << 20, help='Bytes of PNGs kept in memory.')
+parser.add_argument('--render-dir', dest='renderDirectory', default=None,
+                    help='Directory to keep PNGs evicted from memory.')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    try:
+        asyncio.run(Server(
+            args.idle, args.think, args.processes, args.renderBytes,
+            args.renderDirectory).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,195 @@
+'''Outcome statistics for random games of Meta Noughts and Crosses.
+
+Games are spread over worker processes in fixed-size chunks. Each chunk
+is seeded from the run seed and its own index, so results do not
+depend on scheduling. Workers fold every game into a small `Tally`
+(winner, length and first grid, per variant), and only the tallies
+are sent back and merged, so memory stays flat however many games
+are played.
+
+    python stats.py 1000000 --no-middle --processes 8
+'''
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import json
+import math
+import os
+import random
+import time
+
+import bitboard
+
+TAGS = {0: 'errors', 1: 'noughts', 2: 'crosses', 3: 'draws'}
+
+# start grid, then at most a placement and a send for each cell
+MAX_MOVES = 1 + 81 * 2
+
+
+def wilson(k, n, z=1.96):
+    '''Wilson score interval for a proportion k/n (95% by default).'''
+    if not n:
+        return 0.0, 1.0
+    p = k / n
+    centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+    spread = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(0.0, centre - spread), min(1.0, centre + spread)
+
+
+class Tally:
+    '''Running aggregates of game summaries for one variant.'''
+
+    def __init__(self, middleStart=True, startGrid=None):
+        self.middleStart = middleStart
+        self.startGrid = startGrid
+        self.games = 0
+        self.winners = [0] * 4
+        self.lengths = [0] * (MAX_MOVES + 1)
+        self.firstGrids = [[0] * 4 for i in range(9)]
+
+    def add(self, winner, length, firstGrid):
+        self.games += 1
+        self.winners[winner] += 1
+        self.lengths[length] += 1
+        self.firstGrids[firstGrid][winner] += 1
+
+    def merge(self, other):
+        self.games += other.games
+        for i in range(4):
+            self.winners[i] += other.winners[i]
+        for i, n in enumerate(other.lengths):
+            self.lengths[i] += n
+        for mine, theirs in zip(self.firstGrids, other.firstGrids):
+            for i in range(4):
+                mine[i] += theirs[i]
+        return self
+
+    def meanLength(self):
+        return sum(i * n for i, n in enumerate(self.lengths)) / (self.games or 1)
+
+    def asDict(self):
+        return {
+            'middleStart': self.middleStart,
+            'startGrid': self.startGrid,
+            'games': self.games,
+            'outcomes': {
+                tag: {'count': self.winners[i],
+                      'rate': self.winners[i] / (self.games or 1),
+                      'ci95': wilson(self.winners[i], self.games)}
+                for i, tag in TAGS.items()},
+            'meanLength': self.meanLength(),
+            'lengths': {i: n for i, n in enumerate(self.lengths) if n},
+            'firstGrids': self.firstGrids,
+        }
+
+
+def playChunk(n, seed, middleStart=True, startGrid=None):
+    '''Play n random games and return their Tally.'''
+    rand = random.Random(seed).random
+    tally = Tally(middleStart, startGrid)
+    for i in range(n):
+        if startGrid == 'random':
+            # random, but not unfair advantage in centre
+            grid = int(rand() * 8)
+            game = bitboard.BitMNAC(grid + (grid > 3), middleStart)
+        else:
+            game = bitboard.BitMNAC(startGrid, middleStart)
+        if game.state == 'begin':
+            game.stressTest(1, rand)
+        first = game.grid
+        game.stressTest(rand=rand)
+        tally.add(game.winner, game.moves, first)
+    return tally
+
+
+def run(n, middleStart=True, startGrid=None, processes=None, seed=0,
+        chunkSize=2000):
+    '''Play n random games over a process pool and return the Tally.
+
+    processes=1 plays every chunk in this process.'''
+    tally = Tally(middleStart, startGrid)
+    chunks = ((min(chunkSize, n - start), '{}/{}'.format(seed, i))
+              for i, start in enumerate(range(0, n, chunkSize)))
+
+    if processes == 1:
+        for size, chunkSeed in chunks:
+            tally.merge(playChunk(size, chunkSeed, middleStart, startGrid))
+        return tally
+
+    processes = processes or os.cpu_count()
+    with ProcessPoolExecutor(processes) as pool:
+        pending = set()
+        for size, chunkSeed in chunks:
+            # keep a bounded number of chunks in flight
+            if len(pending) >= processes * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tally.merge(future.result())
+            pending.add(pool.submit(
+                playChunk, size, chunkSeed, middleStart, startGrid))
+        for future in pending:
+            tally.merge(future.result())
+    return tally
+
+
+def report(tally, time_taken=None, histogram=True):
+    '''Print a Tally in the style of mnac._test.'''
+    n = tally.games
+    if not n:
+        print('0 games')
+        return tally
+    fmt = ('{:<%s} ' % max(1, math.ceil(math.log10(n + 1)))).format
+
+    if time_taken is None:
+        print(fmt(n) + 'games')
+    else:
+        print(fmt(n) + 'games in {:.1f}s ({:.6f}s per game)'.format(
+            time_taken, time_taken / (n or 1)))
+    for i, tag in TAGS.items():
+        tag_n = tally.winners[i]
+        low, high = wilson(tag_n, n)
+        proportion = 10 + math.ceil(10 * math.log10((tag_n or 1) / (n / 3)))
+        print(fmt(tag_n) + '{:<7} {:6.2%} ({:6.2%} - {:6.2%}) {}'.format(
+            tag, tag_n / (n or 1), low, high, '*' * max(proportion, 0)))
+
+    print('mean game length {:.2f} moves'.format(tally.meanLength()))
+    if histogram:
+        buckets = [sum(tally.lengths[i:i + 10])
+                   for i in range(0, len(tally.lengths), 10)]
+        peak = max(buckets) or 1
+        for i, count in enumerate(buckets):
+            if count:
+                print('{:>3}-{:<3} {} {}'.format(
+                    i * 10, i * 10 + 9, fmt(count), '*' * math.ceil(40 * count / peak)))
+    return tally
+
+
+parser = argparse.ArgumentParser(
+    description='Outcome statistics for random games of MNAC.')
+parser.add_argument('n', type=int, nargs='?', default=50000,
+                    help='Number of games per variant.')
+parser.add_argument('--no-middle', dest='middleStart', action='store_false',
+                    help='Use the house rule forbidding a middle start.')
+parser.add_argument('--start-grid', dest='startGrid', default=None,
+                    help="Grid to start in (0-8), or 'random'.")
+parser.add_argument('-p', '--processes', type=int, default=None,
+                    help='Worker processes (default: one per CPU).')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--chunk-size', dest='chunkSize', type=int, default=2000)
+parser.add_argument('--json', action='store_true',
+                    help='Print the results as JSON instead.')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    startGrid = args.startGrid
+    if startGrid is not None and startGrid != 'random':
+        startGrid = int(startGrid)
+
+    start = time.perf_counter()
+    tally = run(args.n, args.middleStart, startGrid, args.processes,
+                args.seed, args.chunkSize)
+    time_taken = time.perf_counter() - start
+    if args.json:
+        print(json.dumps(dict(tally.asDict(), seconds=time_taken)))
+    else:
+        report(tally, time_taken)
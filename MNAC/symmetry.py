@@ -0,0 +1,141 @@
+'''Symmetries of the Meta Noughts and Crosses board.
+
+The board has the 8 symmetries of a square (rotations and reflections),
+each acting on the meta grid and on every grid within it at once. They
+are given as permutations of the indices 0-8 (row by row, as in
+`MNAC.grids`), numbered as in TRANSFORMS.
+
+A position's canonical key is the least Zobrist key among its images,
+so the 8 symmetric versions of a position share one entry in a cache
+or book:
+
+    key, t = canonicalKey(game)
+    # a move stored for the canonical position, played in this one
+    move = transformMove(stored, INVERSE[t])
+'''
+
+from array import array
+
+import mnac
+
+
+def _permutation(f):
+    return tuple(y * 3 + x for x, y in (f(i % 3, i // 3) for i in range(9)))
+
+
+TRANSFORMS = tuple(map(_permutation, (
+    lambda x, y: (x, y),  # identity
+    lambda x, y: (2 - y, x),  # rotate 90 clockwise
+    lambda x, y: (2 - x, 2 - y),  # rotate 180
+    lambda x, y: (y, 2 - x),  # rotate 90 anticlockwise
+    lambda x, y: (2 - x, y),  # mirror left to right
+    lambda x, y: (x, 2 - y),  # mirror top to bottom
+    lambda x, y: (y, x),  # mirror in the leading diagonal
+    lambda x, y: (2 - y, 2 - x),  # mirror in the other diagonal
+)))
+
+INVERSE = tuple(
+    next(u for u, q in enumerate(TRANSFORMS) if all(q[p[i]] == i for i in range(9)))
+    for p in TRANSFORMS)
+
+_tables = None
+
+
+def _buildTables():
+    '''Grid codes under each transform, and the XOR of the cell keys
+    of every grid code at every grid, as in mnac.MNAC._computeKey.'''
+    codes = []
+    for p in TRANSFORMS:
+        table = [0]
+        for c in range(9):
+            table = [y + v * mnac.TRITS[p[c]] for v in range(3) for y in table]
+        codes.append(array('H', table))
+
+    keys = []
+    for g in range(9):
+        table = [0]
+        for c in range(9):
+            table = [z ^ k for k in (0, mnac.ZOBRIST_CELLS[1][g * 9 + c],
+                                     mnac.ZOBRIST_CELLS[2][g * 9 + c])
+                     for z in table]
+        keys.append(array('Q', table))
+    return codes, keys
+
+
+def transformIndex(index, t):
+    '''A grid or cell index (0-8) under transform t.'''
+    return TRANSFORMS[t][index]
+
+
+def transformMove(move, t):
+    '''An mnac.Move under transform t.'''
+    p = TRANSFORMS[t]
+    grid, cell, send = move
+    return mnac.Move(p[grid], None if cell is None else p[cell],
+                     None if send is None else p[send])
+
+
+def transform(game, t):
+    '''New MNAC with the position of a game under transform t.'''
+    p = TRANSFORMS[t]
+    image = mnac.MNAC(middleStart=game.middleStart)
+    grids = [None] * 9
+    gridStatus = [0] * 9
+    for g in range(9):
+        cells = [0] * 9
+        for c, status in enumerate(game.grids[g]):
+            cells[p[c]] = status
+        grids[p[g]] = cells
+        gridStatus[p[g]] = game.gridStatus[g]
+    image.grids = grids
+    image.codes = [mnac.encodeGrid(cells) for cells in grids]
+    image.gridStatus = gridStatus
+    image.grid = None if game.grid is None else p[game.grid]
+    image.state = game.state
+    image.player = game.player
+    image.winner = game.winner
+    image.moves = game.moves
+    if game.lastPlacedGrid is not None:
+        image.lastPlacedGrid = p[game.lastPlacedGrid]
+        image.lastPlacedCell = p[game.lastPlacedCell]
+    image.key = image._computeKey()
+    return image
+
+
+def keys(game):
+    '''Zobrist key of a game's position under each transform.'''
+    global _tables
+    if _tables is None:
+        _tables = _buildTables()
+    codeTables, keyTables = _tables
+
+    codes = game.codes
+    frame = mnac.ZOBRIST_STATES[game.state]
+    if game.player == 2:
+        frame ^= mnac.ZOBRIST_CROSSES
+    if not game.middleStart:
+        frame ^= mnac.ZOBRIST_NO_MIDDLE
+
+    found = []
+    grid = game.grid
+    for p, table in zip(TRANSFORMS, codeTables):
+        key = frame ^ mnac.ZOBRIST_GRIDS[None if grid is None else p[grid]]
+        for g in range(9):
+            key ^= keyTables[p[g]][table[codes[g]]]
+        found.append(key)
+    return found
+
+
+def canonicalKey(game):
+    '''The least key of a game's position under any transform, and
+    the first transform giving it.'''
+    found = keys(game)
+    key = min(found)
+    return key, found.index(key)
+
+
+def canonical(game):
+    '''New MNAC with the canonical position of a game, and the
+    transform that maps the game to it.'''
+    key, t = canonicalKey(game)
+    return transform(game, t), t
@@ -7,6 +7,7 @@ import os
 import re
 import sys
 
+import instrument
 import mnac
 
 COLOURS = {
@@ -41,13 +42,103 @@ ERROR = colourify('red')
 TAKEN = colourify('gray')
 NORMAL = colourify()
 
+CLEAR = '\033[H\033[2J'
+CLEAR_LINE = '\033[K'
+
+
+def moveTo(row, column):
+    '''Escape sequence moving the cursor, counting from 0.'''
+    return '\033[{};{}H'.format(row + 1, column + 1)
+
+
+class Screen:
+    '''A terminal frame redrawn by writing only what changed.
+
+    Frames are lists of lines, each a list of (colour, text) runs. The
+    last frame drawn is kept as a grid of (colour, character) cells,
+    and each draw writes just the runs of cells that differ, with
+    cursor addressing, as one write to the output.'''
+
+    # Unchanged cells shorter than this between two changes are
+    # rewritten rather than skipped, as moving costs about as much
+    GAP = 6
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.reset()
+
+    def reset(self):
+        '''Clear the screen and repaint everything on the next draw.'''
+        self.rows = None
+        self.colour = None
+        self.height = 0
+
+    @staticmethod
+    def _cells(line):
+        # spaces look the same in any colour
+        return [(NORMAL if char == ' ' else colour or NORMAL, char)
+                for colour, text in line for char in text]
+
+    def _write(self, out, cells):
+        for colour, char in cells:
+            if colour != self.colour and char != ' ':
+                out.append(colour)
+                self.colour = colour
+            out.append(char)
+
+    def draw(self, lines, cursor=None):
+        '''Draw a frame, leaving the cursor at (row, column) if given.'''
+        out = []
+        if self.rows is None:
+            out.append(CLEAR)
+            self.rows = []
+        frame = [self._cells(line) for line in lines]
+        for y in range(max(len(frame), len(self.rows))):
+            new = frame[y] if y < len(frame) else []
+            old = self.rows[y] if y < len(self.rows) else []
+            changed = [x for x, cell in enumerate(new)
+                       if x >= len(old) or old[x] != cell]
+            start = 0
+            while start < len(changed):
+                end = start
+                while end + 1 < len(changed) and \
+                        changed[end + 1] - changed[end] <= self.GAP:
+                    end += 1
+                out.append(moveTo(y, changed[start]))
+                self._write(out, new[changed[start]:changed[end] + 1])
+                start = end + 1
+            if len(old) > len(new):
+                out.append(moveTo(y, len(new)) + CLEAR_LINE)
+        self.rows = frame
+        self.height = len(frame)
+        if cursor is not None:
+            out.append(moveTo(*cursor))
+        if out:
+            self.out.write(''.join(out))
+            self.out.flush()
+
+    def typed(self, row, column, text):
+        '''Note text echoed by the terminal, so the next draw erases it.'''
+        if self.rows is not None and row < len(self.rows):
+            cells = self.rows[row][:column]
+            cells += [(None, ' ')] * (column - len(cells))
+            self.rows[row] = cells + [(None, char) for char in text]
+
+    def end(self):
+        '''Leave the cursor below the frame.'''
+        self.out.write(moveTo(self.height, 0) + NORMAL)
+        self.out.flush()
+
 
 class AsciiMNAC(mnac.MNAC):
     def __init__(self, args):
         self.args = args
+        self.screen = Screen()
         super().__init__(middleStart=args.middleStart)
 
-    def _grid(self, grid, colors=True):
+    def _runs(self, grid, colors=True):
+        '''The four lines of a grid (three rows of cells and its
+        selector) as lists of (colour, text) runs.'''
         normal = NORMAL
         tele = INFO
         noughts = NOUGHTS
@@ -64,35 +155,49 @@ class AsciiMNAC(mnac.MNAC):
             normal = noughts = crosses = tele = TAKEN
 
         symbols = [
-            noughts + 'x' if cell == 1 else
-            crosses + 'o' if cell == 2 else
-            ' ' if taken in (1, 2) else
-            tele + '.' if c == grid or self.gridStatus[c] != 0 else
-            normal + '.'
+            (noughts, 'x') if cell == 1 else
+            (crosses, 'o') if cell == 2 else
+            ('', ' ') if taken in (1, 2) else
+            (tele, '.') if c == grid or self.gridStatus[c] != 0 else
+            (normal, '.')
             for c, cell in enumerate(self.grids[grid])]
 
         if self.state == 'begin' and grid == 4 and not self.middleStart:
-            selector = '   '
+            selector = ('', '   ')
         else:
             n = mnac.numpad(grid+1)
             if self.grid == grid:
                 col = noughts if self.player == 1 else crosses
-                selector = f'{col}[{n}]'
+                selector = (col, f'[{n}]')
             elif self.state == 'outer':
-                selector = f'{tele} {n} '
+                selector = (tele, f' {n} ')
             else:
-                selector = f'{normal} {n} '
-        return [''.join(symbols[0:3]), ''.join(symbols[3:6]), ''.join(symbols[6:9]), selector]
+                selector = (normal, f' {n} ')
+        return [symbols[0:3], symbols[3:6], symbols[6:9], [selector]]
 
-    def __repr__(self):
-        rows = []
+    def _grid(self, grid, colors=True):
+        return [''.join(c + t for c, t in line)
+                for line in self._runs(grid, colors)]
+
+    def _board(self):
+        '''Lines of the board as lists of (colour, text) runs.'''
+        lines = []
         for row in range(3):
+            if row:
+                lines.append([])
             # transpose
-            chars = zip(*(self._grid(row * 3 + col)
-                        for col in range(3)))
-            rows.append('\n'.join(map(' '.join, chars)))
+            for parts in zip(*(self._runs(row * 3 + col)
+                               for col in range(3))):
+                line = list(parts[0])
+                for part in parts[1:]:
+                    line.append(('', ' '))
+                    line += part
+                lines.append(line)
+        return lines
 
-        return '\n\n'.join(rows)
+    def __repr__(self):
+        return '\n'.join(''.join(c + t for c, t in line)
+                         for line in self._board())
 
     def onPlace(self, _, index):
         pass
@@ -106,42 +211,58 @@ class AsciiMNAC(mnac.MNAC):
         else:
             return 'Send your opponent to'
 
+    def _frame(self):
+        '''Lines of the whole screen, as lists of (colour, text) runs.'''
+        lines = [[(INFO, 'Meta Noughts and Crosses')], []]
+        lines += self._board()
+        lines.append([])
+        if self._last_error:
+            lines.append([(ERROR, '[ {} ]'.format(self._last_error))])
+        else:
+            lines.append([])
+
+        if self.winner:
+            lines.append([(NORMAL, 'GAME OVER! {}!'.format(
+                ['Noughts wins', 'Crosses wins', "It's a draw"][self.winner-1]))])
+        else:
+            lines.append([
+                (NOUGHTS, 'Noughts') if self.player == 1 else (CROSSES, 'Crosses'),
+                (NORMAL, '{}: {}... > '.format(
+                    ' in {} grid'.format(mnac.DIRECTIONS[self.grid][1])
+                    if self.grid is not None else '',
+                    self.action))])
+        return lines
+
     def _loop(self):
         self._last_error = ''
         if os.name == 'nt':
+            # also turns on escape sequences in the console
             os.system('title Meta Noughts and Crosses')
 
         while True:
-            os.system('cls' if os.name == 'nt' else 'clear')
-
-            print('{}Meta Noughts and Crosses\n\n{}\n'.format(
-                INFO, repr(self)))
-            if self._last_error:
-                print('{}[ {} ]{}'.format(
-                    ERROR, self._last_error, NORMAL))
-            else:
-                print()
-
-            self._last_error = ''
-
+            lines = self._frame()
             if self.winner:
-                print('GAME OVER! {}!'.format(
-                    ['Noughts wins', 'Crosses wins', "It's a draw"][self.winner-1]))
+                self.screen.draw(lines)
+                self.screen.end()
                 sys.exit(self.winner)
 
-            prompt = ('{}{}{}: {}... > '.format(
-                NOUGHTS + 'Noughts' if self.player == 1 else CROSSES + 'Crosses', NORMAL,
-                ' in {} grid'.format(
-                    mnac.DIRECTIONS[self.grid][1]) if self.grid is not None else '',
-                self.action))
+            prompt = (len(lines) - 1, sum(len(t) for c, t in lines[-1]))
+            self.screen.draw(lines, prompt)
+            self._last_error = ''
 
-            # TODO: handle eg '12' if and only if a teleporter move can be played?
+            # TODO: handle eg '12' if and only if a teleporter move can be played?
 
-            inp = input(prompt).lower().strip().replace(
+            typed = input()
+            self.screen.typed(*prompt, typed)
+            inp = typed.lower().strip().replace(
                 ' ', '').replace('-', '')
             if 'exit' in inp or inp == 'q':
+                self.screen.end()
                 sys.exit(0)
             elif not inp:
+                # a blank line repaints everything, in case the
+                # screen was disturbed
+                self.screen.reset()
                 continue
 
             index = mnac.getIndex(inp)
@@ -158,7 +279,8 @@ class AsciiMNAC(mnac.MNAC):
     def loop(self):
         try:
             self._loop()
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, EOFError):
+            self.screen.end()
             sys.exit(0)
 
 
@@ -170,5 +292,5 @@ parser.add_argument('-m', '--middleStart', dest='middleStart', action='store_tru
 
 if __name__ == '__main__':
     args = parser.parse_args()
-    self = AsciiMNAC(args)
+    self = instrument.classFor(AsciiMNAC)(args)
     self.loop()
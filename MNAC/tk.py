@@ -7,36 +7,205 @@ Requires Python >3.6, tkinter and mnac.
 1.2: new status menu, controls, help menu
 1.3: better mouse handling
 1.4: UI tweaks and touchups
+1.5: computer opponent, which thinks without freezing the window
 '''
 
+import queue
 import random
 import os
+import threading
+import time
 
 import tkinter as tk
 import numpy as np
 
+import bitboard
+import engine
+import instrument
 import mnac
 import render
 
-__version__ = '1.4'
+__version__ = '1.5'
 
 TITLE = f'TkMNAC v{__version__} / yunru.se'
 
+# Milliseconds without resize events before redrawing
+RESIZE_DELAY = 40
+
+# Milliseconds between checks for the computer's turn
+POLL_INTERVAL = 50
+
+# Seconds the computer thinks for, and ponders for at most
+THINK_TIME = 1.0
+PONDER_TIME = 60.0
+
+
+class Computer:
+    '''Engine searches on a worker thread, for the computer's turns and
+    for pondering while the human thinks.
+
+    Pondering searches the position after the reply the engine expects
+    to its last turn. If that reply is played, the turn is chosen from
+    the ponder, or a shorter search with a transposition table already
+    warm from it.
+
+    Only the Tk thread calls think(), ponder(), cancel() and result().
+    Each search has a threading.Event to stop it, which the engine
+    checks every thousand or so nodes; results of stopped searches
+    are dropped.'''
+
+    def __init__(self, thinkTime=THINK_TIME):
+        self.engine = engine.Engine()
+        self.thinkTime = thinkTime
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.stop = threading.Event()
+        self.thinking = self.pondering = False
+        # (key, result, seconds) of the last ponder, for the worker
+        self.pondered = None
+        threading.Thread(target=self._work, name='computer',
+                         daemon=True).start()
+
+    def _submit(self, kind, game):
+        self.stop.set()
+        self.stop = threading.Event()
+        self.thinking = kind == 'think'
+        self.pondering = kind == 'ponder'
+        self.tasks.put((kind, bitboard.BitMNAC.fromGame(game), self.stop))
+
+    def think(self, game):
+        '''Start choosing a turn for the player to move.'''
+        self._submit('think', game)
+
+    def ponder(self, game):
+        '''Ponder until cancelled, while the human moves in this game.'''
+        self._submit('ponder', game)
+
+    def cancel(self):
+        self.stop.set()
+        self.thinking = self.pondering = False
+
+    def result(self):
+        '''play() indices of the turn chosen, or None if there is none yet.'''
+        while True:
+            try:
+                stop, steps = self.results.get_nowait()
+            except queue.Empty:
+                return None
+            if not stop.is_set():
+                self.thinking = False
+                return steps
+
+    # %% worker thread
+
+    def _work(self):
+        while True:
+            kind, board, stop = self.tasks.get()
+            if stop.is_set():
+                continue
+            if kind == 'ponder':
+                self._ponder(board, stop)
+            else:
+                move = self._think(board, stop)
+                self.results.put((stop, [] if move is None else board.steps(move)))
+
+    def _ponder(self, board, stop):
+        reply = self.engine.tableMove(board)
+        if reply is None or reply not in board.legalMoves():
+            return
+        board.make(reply)
+        if board.winner:
+            return
+        start = time.perf_counter()
+        result = self.engine.search(board, PONDER_TIME, stop=stop)
+        self.pondered = (board.key, result, time.perf_counter() - start)
+
+    def _think(self, board, stop):
+        pondered, self.pondered = self.pondered, None
+        timeLimit = self.thinkTime
+        if pondered is not None and pondered[0] == board.key:
+            key, result, seconds = pondered
+            if seconds >= self.thinkTime and result.move is not None:
+                return result.move
+            # the table is warm from pondering, so make up the difference
+            timeLimit = max(self.thinkTime - seconds, self.thinkTime / 4)
+        return self.engine.search(board, timeLimit, stop=stop).move
+
+
 class CanvasRender(render.Render):
-    '''Tkinter Canvas-based renderer.'''
+    '''Tkinter Canvas-based renderer.
+
+    Canvas items are created once and kept between draws. Each has a
+    slot (what it shows, such as the cell it backs), and is moved or
+    reconfigured only when its coordinates or options change. Items
+    not needed by a draw are hidden, not deleted.'''
 
     font = 'Segoe UI'
 
+    # Stacking order of item tags, bottom first
+    LAYERS = ('backing', 'mark', 'play', 'status')
+
     def __init__(self, app, theme='light'):
         self.app = app
         self.canvas = app.canvas
-        self.coordinates = {}
-        self.theme = render.THEMES[theme]
+        self.theme = render.getTheme(theme)
         self.error = False
+        # slot: [item, coords, options, shown]
+        self.items = {}
+        self.bg = None
+
+    def item(self, kind, slot, coords, tags, **options):
+        '''Create or update the canvas item for a slot.'''
+        key = (kind, slot)
+        self.used.add(key)
+        coords = tuple(coords)
+        entry = self.items.get(key)
+        if entry is None:
+            create = getattr(self.canvas, 'create_' + kind)
+            item = create(*coords, tags=tags, **options)
+            self.items[key] = [item, coords, options, True]
+            self.created = True
+            return item
+
+        item, oldCoords, oldOptions, shown = entry
+        if coords != oldCoords:
+            self.canvas.coords(item, *coords)
+        changed = {k: v for k, v in options.items() if oldOptions.get(k) != v}
+        if not shown:
+            changed['state'] = 'normal'
+        if changed:
+            self.canvas.itemconfig(item, **changed)
+        entry[1:] = coords, options, True
+        return item
+
+    def skipGrid(self, grid):
+        # ellipse, polygon and text are not told which grid or cell
+        # they are for, so keep track of it here and in cell()
+        self.drawing = (grid, None)
+        return False
+
+    def hideUnused(self):
+        '''Hide the items not used by this draw, and restack any new ones.'''
+        for key, entry in self.items.items():
+            if entry[3] and key not in self.used:
+                self.canvas.itemconfig(entry[0], state='hidden')
+                entry[3] = False
+        if self.created:
+            # new items are created on top of everything else
+            for tag in self.LAYERS[1:]:
+                self.canvas.tag_raise(tag)
+
+    def reset(self):
+        '''Delete every canvas item, so the next draw creates them anew.'''
+        self.canvas.delete(*self.LAYERS)
+        self.items = {}
+        self.bg = None
 
     def draw(self):
         self.game = self.app.game
         self.error = self.app.error
+        self.used = set()
+        self.created = False
 
         # determine colours and status
         players = [
@@ -70,27 +239,32 @@ class CanvasRender(render.Render):
             self.topleft += ((w - h) / 2, 0)
         else:
             self.topleft += (0, (h - w) / 2)
+        self.offset = tuple(self.topleft)
 
-        self.canvas.config(bg=self.background())
-        self.canvas.delete('status', 'backing', 'mark', 'play')
-        self.canvas.tag_unbind('backing', '<Button-1>')
+        if self.bg != self.background():
+            self.bg = self.background()
+            self.canvas.config(bg=self.bg)
 
         font_size = int(self.size / 32)
         glyph_size = int(font_size * 1.5)
 
         leftText = 'tab: help'
+        rightText = ''
+        if self.app.computerPlayer is not None:
+            rightText = 'thinking...' if self.app.opponent.thinking else 'vs computer'
         if self.app.showHelp:
             text = ''
             leftText = 'tab: back to game'
 
         header = (
-            lambda x, y=header_height / 2, fill=titlefill, **kw:
-            self.canvas.create_text(
-                x, y, fill=fill,
-                tags='status', font=(self.font, font_size), **kw))
+            lambda slot, x, y=header_height / 2, fill=titlefill, **kw:
+            self.item(
+                'text', ('status', slot), (x, y), 'status', fill=fill,
+                font=(self.font, font_size), **kw))
 
-        header(self.topleft[0] + 5,           anchor='w', text=leftText)
-        header(self.topleft[0] + self.size/2, anchor='center', text=text)
+        header('left', self.topleft[0] + 5,           anchor='w', text=leftText)
+        header('centre', self.topleft[0] + self.size/2, anchor='center', text=text)
+        header('right', self.topleft[0] + self.size - 5, anchor='e', text=rightText)
 
         def draw_glyph(fromRight, glyph, fill): return self.canvas.create_polygon(
             *(glyph * glyph_size + (
@@ -103,9 +277,10 @@ class CanvasRender(render.Render):
         # draw beginning help in middle cell
 
         if self.app.showHelp:
-            self.canvas.create_rectangle(
-                *self.topleft, *(self.topleft + self.size),
-                width=0, fill=titlefill, tags='status', stipple="gray50")
+            self.item(
+                'rectangle', ('status', 'help'),
+                (*self.topleft, *(self.topleft + self.size)), 'status',
+                width=0, fill=titlefill, stipple="gray50")
             for i, text in enumerate((
                 'The board is 9 grids each with 9 cells. Play to win',
                 'a grid, and win the larger grids to win the game.',
@@ -124,39 +299,43 @@ class CanvasRender(render.Render):
                 '',
                 'CONTROLS:',
                 'Control-R: Restart the game',
+                'Control-E: Play against the computer',
                 'Keys 1-9 and mouse/touch:  Play in cell / grid'
             ), start=1):
-                header(w/2, self.topleft[1] + i * 1.5 *
+                header(i, w/2, self.topleft[1] + i * 1.5 *
                        font_size, fill='black', text=text)
 
+        self.hideUnused()
+
+    def locate(self, x, y):
+        '''Return the (grid, cell) drawn at a point, counting from 0,
+        or None if there is none.'''
+        return self.layout.locate(x, y)
+
     def cell(self, grid, cell, tl, size, fill):
-        tl += self.topleft
         coords = (*tl, *(tl+size))
-        backing = self.canvas.create_rectangle(
-            *coords, width=0, fill=fill, tags='backing')
-
-        self.coordinates[grid+1, cell+1] = coords
+        self.drawing = (grid, cell)
+        self.item('rectangle', self.drawing, coords, 'backing',
+                  width=0, fill=fill)
 
     def ellipse(self, coords, outline, width):
-        coords += (*self.topleft, *self.topleft)
-        self.canvas.create_oval(
-            *coords, width=width, outline=outline, tags='mark')
+        self.item('oval', self.drawing, coords, 'mark',
+                  width=width, outline=outline)
 
     def polygon(self, coords, fill):
-        coords += self.topleft
-        self.canvas.create_polygon(
-            *coords.flatten(), fill=fill, width=0, tags='mark')
+        self.item('polygon', self.drawing, coords.flatten(), 'mark',
+                  fill=fill, width=0)
 
     def text(self, coords, isLarge, text, size, fill):
-        coords += self.topleft
         # this is arbitrary and needs a lot more playtesting :(
         if os.name == 'posix':
             fiddle = (2/9, -3/9) if isLarge else (-2/9, -4/9)
         else:
             fiddle = (1/9, -7/6) if isLarge else (-2/9, -2/3)
-        coords += np.array(fiddle) * self.size / (9 + 2 * self.SEPARATION)
-        self.canvas.create_text(
-            *coords, text=text, fill=fill, font=(self.font, size), anchor='nw', tags='play')
+        coords = coords + self.layout.scaled(fiddle)
+        slot = (self.drawing[0], None) if isLarge else self.drawing
+        self.item('text', slot, coords, 'play', text=text, fill=fill,
+                  font=(self.font, size), anchor='nw')
 
 
 class UIMNAC(tk.Tk):
@@ -175,9 +354,17 @@ class UIMNAC(tk.Tk):
         self.canvas.grid(row=1, column=1, columnspan=3, sticky='news')
 
         self.render = CanvasRender(self)
+        self.pendingDraw = None
+        self.pendingResize = None
+        self.pendingPoll = None
+
+        # the Computer, and the player it plays as, if any
+        self.opponent = None
+        self.computerPlayer = None
 
-        self.bind_all('<Configure>', self.redraw)
+        self.canvas.bind('<Configure>', self.onResize)
         self.bind_all('<Control-r>', self.restart)
+        self.bind_all('<Control-e>', self.toggleComputer)
         self.bind_all('<Tab>', self.toggleHelp)
         self.bind_all('<Escape>', self.clearError)
         self.canvas.bind('<Button-1>', self.onClick)
@@ -190,10 +377,54 @@ class UIMNAC(tk.Tk):
     def restart(self, *event):
         self.showHelp = False
         self.error = ''
-
-        self.game = mnac.MNAC(middleStart=False)
+        if self.opponent is not None:
+            self.opponent.cancel()
+
+        self.game = instrument.classFor(mnac.MNAC)(middleStart=False)
+        self.moved()
+
+    def toggleComputer(self, *event):
+        '''Have the computer play crosses, or stop it playing.'''
+        if self.computerPlayer is None:
+            if self.opponent is None:
+                self.opponent = Computer()
+            self.computerPlayer = 2
+        else:
+            self.computerPlayer = None
+            self.opponent.cancel()
+        self.moved()
+
+    def moved(self):
+        '''Start the computer's turn or its pondering, as the position
+        now needs, and redraw.'''
+        if self.computerPlayer is not None:
+            game = self.game
+            if game.winner:
+                self.opponent.cancel()
+            elif game.player == self.computerPlayer:
+                if not self.opponent.thinking:
+                    self.opponent.think(game)
+                    # start one poll chain for this search, ending any other
+                    if self.pendingPoll is not None:
+                        self.after_cancel(self.pendingPoll)
+                    self.poll()
+            elif not self.opponent.pondering:
+                self.opponent.ponder(game)
         self.redraw()
 
+    def poll(self):
+        '''Play the computer's turn once it is chosen.'''
+        self.pendingPoll = None
+        steps = self.opponent.result()
+        if steps is None:
+            if self.opponent.thinking:
+                self.pendingPoll = self.after(POLL_INTERVAL, self.poll)
+            return
+        for i in steps:
+            self.game.play(i)
+        if steps:
+            self.moved()
+
     def clearError(self, *event):
         self.error = ''
         self.redraw()
@@ -212,8 +443,24 @@ class UIMNAC(tk.Tk):
         return w, h, s, tl, header_height
 
     def redraw(self, *event):
+        '''Draw once Tk is idle. Calls before then share the one draw.'''
+        if self.pendingDraw is None:
+            self.pendingDraw = self.after_idle(self.drawNow)
+
+    def drawNow(self):
+        self.pendingDraw = None
         self.render.draw()
 
+    def onResize(self, event):
+        # dragging the window sends a stream of these, so wait for a pause
+        if self.pendingResize is not None:
+            self.after_cancel(self.pendingResize)
+        self.pendingResize = self.after(RESIZE_DELAY, self.resized)
+
+    def resized(self):
+        self.pendingResize = None
+        self.redraw()
+
     def onClick(self, event):
         if self.game.winner:
             return
@@ -228,15 +475,10 @@ class UIMNAC(tk.Tk):
             else:
                 self.clearError()
 
-        # Iterate through all coordinates the renderer claims
-        # each cell was at
-        for coord, bounds in self.render.coordinates.items():
-            x1, y1, x2, y2 = bounds
-            if x1 <= event.x <= x2 and y1 <= event.y <= y2:
-                grid, cell = coord
-                break
-        else:
+        located = self.render.locate(event.x, event.y)
+        if located is None:
             return
+        grid, cell = located[0] + 1, located[1] + 1
 
         if self.game.state in ('outer', 'begin'):
             self.play(grid)
@@ -247,7 +489,7 @@ class UIMNAC(tk.Tk):
                 self.play(grid)
 
     def play(self, index):
-        if self.game.winner:
+        if self.game.winner or self.game.player == self.computerPlayer:
             return
         
         self.error = ''
@@ -255,7 +497,7 @@ class UIMNAC(tk.Tk):
             self.game.play(index)
         except mnac.MoveError as e:
             self.error = mnac.ERRORS[e.args[0]]
-        self.redraw()
+        self.moved()
 
     def test_turn(self, *event):
         '''debug: play random moves'''
@@ -268,7 +510,7 @@ class UIMNAC(tk.Tk):
             except mnac.MoveError:
                 continue
 
-        self.render.draw()
+        self.redraw()
 
         if not self.game.winner:
             self.after(500, self.test_turn)
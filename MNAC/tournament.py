@@ -0,0 +1,530 @@
+'''Tournaments between computer players, with Elo ratings.
+
+Players are agents given by a spec, a kind and options:
+
+    random
+    engine:ttSize=65536,book=opening.book
+    mcts:exploration=1.0
+
+Every pair of agents (round robin), or the first agent against each of
+the others (gauntlet), plays a number of seeded openings: a few random
+turns from the run seed, the same for every pair. Each opening is
+played from both sides and in each variant (with and without a middle
+start), so neither agent gets the better of the draw.
+
+Agents get a time limit per turn. An agent that takes much longer
+than that (past GRACE) or plays an illegal move loses the game. Turns
+are timed in CPU time, so a busy machine does not lose games on time,
+and agents must search in the process they are asked in.
+
+Games are played on a process pool, and each result is appended to a
+JSON lines file as it finishes. Running again with the same file
+skips the games already in it, so an interrupted run carries on, and
+adding agents or openings only plays the new games.
+
+    python tournament.py engine mcts random --openings 50 -p 8 -o results.jsonl
+'''
+
+import argparse
+import ast
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import itertools
+import json
+import math
+import os
+import random
+import time
+
+import bitboard
+import book
+import engine
+import mcts
+import stats
+
+# Time over the limit allowed for a turn, as a factor and in seconds
+GRACE = (1.5, 0.05)
+
+# Most random turns in an opening. A third of random games last this
+# long; each turn takes a cell, so none last past 81.
+MAX_PLIES = 60
+
+# Random games tried for an opening before giving up
+OPENING_TRIES = 1000
+
+# Elo per unit of the natural log of the odds
+ELO = 400 / math.log(10)
+
+
+# %% agents
+
+class Agent:
+    '''A computer player. Subclasses choose a turn for the player to
+    move, as an mnac.Move from game.legalMoves(); game is a BitMNAC
+    and should be left as it was found.'''
+
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+
+    def newGame(self, seed):
+        '''Forget anything from the last game.'''
+        self.random.seed(seed)
+
+    def choose(self, game, timeLimit):
+        raise NotImplementedError
+
+
+class RandomAgent(Agent):
+    '''Uniformly random legal turns.'''
+
+    def choose(self, game, timeLimit):
+        return self.random.choice(game.legalMoves())
+
+
+class EngineAgent(Agent):
+    '''engine.Engine, optionally with an opening book file.'''
+
+    def __init__(self, seed=None, book=None, **options):
+        super().__init__(seed)
+        self.engine = engine.Engine(book=_book(book) if book else None,
+                                    **options)
+        # build the evaluation tables now, not in the first timed turn
+        engine.gridValues()
+
+    def newGame(self, seed):
+        super().newGame(seed)
+        self.engine.clear()
+
+    def choose(self, game, timeLimit):
+        return self.engine.search(game, timeLimit).move
+
+
+class MCTSAgent(Agent):
+    '''mcts.MCTS, single process: turns are timed in this process's CPU
+    time, which would not count the work of a pool of workers.'''
+
+    def __init__(self, seed=None, **options):
+        if options.get('workers'):
+            raise ValueError('mcts agents cannot use workers, which would '
+                             'not count towards their time')
+        super().__init__(seed)
+        self.options = options
+        self.mcts = mcts.MCTS(seed=seed, **options)
+
+    def newGame(self, seed):
+        super().newGame(seed)
+        self.mcts = mcts.MCTS(seed=seed, **self.options)
+
+    def choose(self, game, timeLimit):
+        return self.mcts.search(game, timeLimit).move
+
+
+AGENTS = {
+    'random': RandomAgent,
+    'engine': EngineAgent,
+    'mcts': MCTSAgent,
+}
+
+
+def _value(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def parseSpec(spec):
+    '''Kind and options of an agent spec such as 'mcts:exploration=1'.'''
+    kind, _, options = spec.partition(':')
+    if kind not in AGENTS:
+        raise ValueError('unknown agent {!r}; pick from {}'.format(
+            kind, ', '.join(AGENTS)))
+    pairs = (option.partition('=') for option in options.split(',') if option)
+    return kind, {name: _value(value) for name, _, value in pairs}
+
+
+def makeAgent(spec):
+    kind, options = parseSpec(spec)
+    return AGENTS[kind](**options)
+
+
+_books = {}
+
+
+def _book(path):
+    if path not in _books:
+        _books[path] = book.Book(path)
+    return _books[path]
+
+
+# %% games
+
+Job = namedtuple('Job', 'a b middleStart opening swapped seed plies moveTime')
+
+
+def gameKey(a, b, middleStart, opening, swapped):
+    return json.dumps([a, b, middleStart, opening, swapped])
+
+
+def openingMoves(seed, middleStart, opening, plies):
+    '''The turns of a seeded opening, which does not end the game.'''
+    rand = random.Random('{}/{}/{}'.format(seed, int(middleStart), opening))
+    for attempt in range(OPENING_TRIES):
+        game = bitboard.BitMNAC(middleStart=middleStart)
+        moves = []
+        for i in range(plies):
+            move = rand.choice(game.legalMoves())
+            game.make(move)
+            moves.append(move)
+            if game.winner:
+                break
+        else:
+            return moves
+    raise ValueError('no opening of {} turns found'.format(plies))
+
+
+# agents of this process by spec, kept between games
+_agents = {}
+
+
+def _agent(spec):
+    if spec not in _agents:
+        _agents[spec] = makeAgent(spec)
+    return _agents[spec]
+
+
+def playGame(job):
+    '''Play one game of a tournament and return its result as a dict.
+
+    Agent a plays noughts unless the job is swapped. The score is a's:
+    1 for a win, 0.5 for a draw, 0 for a loss.'''
+    game = bitboard.BitMNAC(middleStart=job.middleStart)
+    for move in openingMoves(job.seed, job.middleStart, job.opening, job.plies):
+        game.make(move)
+
+    # indexed by player
+    specs = (None, job.b, job.a) if job.swapped else (None, job.a, job.b)
+    agents = [None, _agent(specs[1]), _agent(specs[2])]
+    for player in (1, 2):
+        agents[player].newGame('{}/{}/{}'.format(
+            job.seed, gameKey(*job[:5]), player))
+
+    allowed = job.moveTime * GRACE[0] + GRACE[1]
+    slowest = [0.0, 0.0, 0.0]
+    turns = 0
+    winner = forfeit = None
+    while not game.winner:
+        moves = game.legalMoves()
+        if not moves:
+            winner = 3
+            break
+        player = game.player
+        start = time.process_time()
+        move = agents[player].choose(game, job.moveTime)
+        elapsed = time.process_time() - start
+        slowest[player] = max(slowest[player], elapsed)
+        if move not in moves:
+            winner, forfeit = 3 - player, 'illegal'
+            break
+        if elapsed > allowed:
+            winner, forfeit = 3 - player, 'time'
+            break
+        game.make(move)
+        turns += 1
+    if winner is None:
+        winner = game.winner
+
+    aPlayer = 2 if job.swapped else 1
+    return {
+        'key': gameKey(*job[:5]),
+        'a': job.a, 'b': job.b,
+        'middleStart': job.middleStart,
+        'opening': job.opening,
+        'swapped': job.swapped,
+        'winner': winner,
+        'score': 1.0 if winner == aPlayer else 0.5 if winner == 3 else 0.0,
+        'forfeit': forfeit,
+        'turns': turns,
+        'slowest': [slowest[aPlayer], slowest[3 - aPlayer]],
+    }
+
+
+# %% results file
+
+def readResults(path, settings):
+    '''Results already in a file, or [] if there is none. The file must
+    have been written with the same settings.'''
+    try:
+        f = open(path)
+    except FileNotFoundError:
+        return []
+    results = []
+    with f:
+        lines = iter(f)
+        header = json.loads(next(lines, 'null') or 'null')
+        if header is not None and header.get('settings') != settings:
+            raise ValueError('{} was played with other settings: {}'.format(
+                path, header and header.get('settings')))
+        for line in lines:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                pass  # cut short when a run was stopped
+    return results
+
+
+class ResultWriter:
+    '''Appends results to a JSON lines file, after a header line.'''
+
+    def __init__(self, path, settings):
+        new = not os.path.exists(path) or not os.path.getsize(path)
+        self.file = open(path, 'a')
+        if new:
+            self.write({'settings': settings})
+        else:
+            # end any line cut short, so the next result starts afresh
+            self.file.write('\n')
+
+    def write(self, result):
+        self.file.write(json.dumps(result) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# %% tournaments
+
+def pairings(specs, gauntlet=False):
+    if gauntlet:
+        return [(specs[0], spec) for spec in specs[1:]]
+    return list(itertools.combinations(specs, 2))
+
+
+def jobs(specs, openings, variants=(True, False), gauntlet=False, seed=0,
+         plies=4, moveTime=0.1):
+    '''Every game of a tournament, both sides of each opening together.'''
+    for opening in range(openings):
+        for middleStart in variants:
+            for a, b in pairings(specs, gauntlet):
+                for swapped in (False, True):
+                    yield Job(a, b, middleStart, opening, swapped, seed,
+                              plies, moveTime)
+
+
+def run(specs, openings, variants=(True, False), gauntlet=False, seed=0,
+        plies=4, moveTime=0.1, path=None, processes=None, progress=None):
+    '''Play a tournament and return the result of every game in it.
+
+    With a path, results are kept there and games already in it are not
+    played again. progress, if given, is called with each new result.
+    processes=1 plays every game in this process.'''
+    for spec in specs:
+        _agent(spec)
+    if not 0 <= plies <= MAX_PLIES:
+        raise ValueError('openings must have 0 to {} turns'.format(MAX_PLIES))
+    settings = {'seed': seed, 'plies': plies, 'moveTime': moveTime}
+    results = {}
+    writer = None
+    if path:
+        results = {r['key']: r for r in readResults(path, settings)}
+        writer = ResultWriter(path, settings)
+
+    def finished(result):
+        results[result['key']] = result
+        if writer:
+            writer.write(result)
+        if progress:
+            progress(result)
+
+    todo = [job for job in jobs(specs, openings, variants, gauntlet, seed,
+                                plies, moveTime)
+            if gameKey(*job[:5]) not in results]
+    try:
+        if processes == 1:
+            for job in todo:
+                finished(playGame(job))
+        else:
+            processes = processes or os.cpu_count()
+            with ProcessPoolExecutor(processes) as pool:
+                pending = set()
+                try:
+                    for job in todo:
+                        # keep a bounded number of games in flight
+                        if len(pending) >= processes * 2:
+                            done, pending = wait(
+                                pending, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                finished(future.result())
+                        pending.add(pool.submit(playGame, job))
+                    for future in pending:
+                        finished(future.result())
+                except BaseException:
+                    pool.shutdown(cancel_futures=True)
+                    raise
+    finally:
+        if writer:
+            writer.close()
+
+    wanted = {gameKey(*job[:5]) for job in jobs(
+        specs, openings, variants, gauntlet, seed, plies, moveTime)}
+    return [r for key, r in results.items() if key in wanted]
+
+
+# %% ratings
+
+def expected(difference):
+    '''Expected score for an Elo difference.'''
+    return 1 / (1 + 10 ** (-difference / 400))
+
+
+def eloDifference(score):
+    '''Elo difference for an expected score between 0 and 1.'''
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def pairStats(results):
+    '''Win, draw and loss counts, score and Elo difference with a 95%
+    interval, for each pair of agents, from the first agent's side.'''
+    pairs = {}
+    for r in results:
+        pairs.setdefault((r['a'], r['b']), []).append(r['score'])
+    for pair, scores in pairs.items():
+        n = len(scores)
+        mean = sum(scores) / n
+        # Wilson bounds hold up on a sweep, where a normal one has no width
+        low, high = stats.wilson(sum(scores), n)
+        pairs[pair] = {
+            'games': n,
+            'wins': scores.count(1.0),
+            'draws': scores.count(0.5),
+            'losses': scores.count(0.0),
+            'score': mean,
+            'elo': eloDifference(mean),
+            'interval': (eloDifference(low), eloDifference(high)),
+        }
+    return pairs
+
+
+def ratings(results, anchor=None, iterations=100):
+    '''Elo rating and a 95% margin for each agent, by maximum
+    likelihood over every game, with anchor (by default the first agent
+    seen) held at 0.
+
+    Each pair that met is given one extra drawn game, so ratings stay
+    finite when one agent won every game.'''
+    scores, games = {}, {}
+    for r in results:
+        pair = r['a'], r['b']
+        scores[pair] = scores.get(pair, 0.5) + r['score']
+        games[pair] = games.get(pair, 1) + 1
+    agents = list(dict.fromkeys(itertools.chain.from_iterable(games)))
+    if not agents:
+        return {}
+    anchor = agents[0] if anchor is None else anchor
+    rating = dict.fromkeys(agents, 0.0)
+
+    def information(agent):
+        # slope and curvature of the log-likelihood in rating, per Elo
+        slope = curve = 0.0
+        for (a, b), n in games.items():
+            if agent not in (a, b):
+                continue
+            e = expected(rating[a] - rating[b])
+            s = scores[a, b]
+            if agent == b:
+                e, s = 1 - e, n - s
+            slope += s - n * e
+            curve += n * e * (1 - e)
+        return slope, curve
+
+    for i in range(iterations):
+        change = 0.0
+        for agent in agents:
+            slope, curve = information(agent)
+            step = ELO * slope / curve
+            rating[agent] += step
+            change = max(change, abs(step))
+        shift = rating[anchor]
+        for agent in agents:
+            rating[agent] -= shift
+        if change < 0.01:
+            break
+
+    return {agent: (rating[agent],
+                    1.96 * ELO / math.sqrt(information(agent)[1]))
+            for agent in agents}
+
+
+def report(results, played=0, elapsed=None):
+    '''Print pair results and ratings, and the rate at which played
+    games were played in elapsed seconds.'''
+    print('{} games'.format(len(results)))
+    if played and elapsed:
+        print('{} played in {:.0f}s ({:.0f} games/hour)'.format(
+            played, elapsed, played * 3600 / elapsed))
+    forfeits = sum(1 for r in results if r['forfeit'])
+    if forfeits:
+        print('{} forfeited on time or by an illegal move'.format(forfeits))
+
+    print()
+    for (a, b), s in pairStats(results).items():
+        print('{} vs {}: +{} ={} -{}  {:.1%}  Elo {:+.0f} ({:+.0f} to {:+.0f})'.format(
+            a, b, s['wins'], s['draws'], s['losses'], s['score'],
+            s['elo'], *s['interval']))
+
+    print()
+    table = sorted(ratings(results).items(), key=lambda i: -i[1][0])
+    width = max((len(agent) for agent, _ in table), default=0)
+    for agent, (rating, margin) in table:
+        print('{:<{}}  {:+6.0f} ± {:.0f}'.format(agent, width, rating, margin))
+
+
+parser = argparse.ArgumentParser(
+    description='Play computer players of MNAC against each other.')
+parser.add_argument('agents', nargs='+',
+                    help='Agent specs, such as random, engine or '
+                    'mcts:exploration=1.0.')
+parser.add_argument('--gauntlet', action='store_true',
+                    help='Play the first agent against each of the others, '
+                    'rather than every pair.')
+parser.add_argument('--openings', type=int, default=20,
+                    help='Openings per pair; each is played from both sides '
+                    'in each variant.')
+parser.add_argument('--plies', type=int, default=4,
+                    help='Random turns in each opening (at most %d).' % MAX_PLIES)
+parser.add_argument('--variant', choices=('both', 'middle', 'no-middle'),
+                    default='both', help='Play with a middle start, '
+                    'without one, or both.')
+parser.add_argument('-t', '--move-time', dest='moveTime', type=float,
+                    default=0.1, help='Seconds each agent gets per turn.')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('-o', '--output', default=None,
+                    help='JSON lines file to keep results in and resume from.')
+parser.add_argument('-p', '--processes', type=int, default=None,
+                    help='Worker processes (default: one per CPU).')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    variants = {'both': (True, False), 'middle': (True, ),
+                'no-middle': (False, )}[args.variant]
+    start = time.perf_counter()
+    played = 0
+
+    def progress(result):
+        global played
+        played += 1
+        if played % 100 == 0:
+            print('{} games played'.format(played), flush=True)
+
+    try:
+        results = run(args.agents, args.openings, variants, args.gauntlet,
+                      args.seed, args.plies, args.moveTime, args.output,
+                      args.processes, progress)
+    except KeyboardInterrupt:
+        if not args.output:
+            raise
+        print('Stopped; run again to carry on.')
+    else:
+        report(results, played, time.perf_counter() - start)